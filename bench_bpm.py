@@ -0,0 +1,65 @@
+import argparse
+import time
+from pathlib import Path
+
+from bpm import FAST_MIN_CONFIDENCE, get_bpm, get_bpm_fast
+
+
+def benchmark(fixture_dir, tolerance=2):
+    """
+    Compare speed and accuracy of the fast BPM estimation against full decoding.
+    The BPM of the full decode is used as the reference.
+    """
+    files = sorted(
+        file
+        for file in Path(fixture_dir).rglob("*.*")
+        if file.suffix.lower() in [".mp3", ".flac", ".m4a", ".wav"]
+    )
+    if not files:
+        print(f"No audio files found in {fixture_dir}")
+        return
+
+    full_total = 0.0
+    fast_total = 0.0
+    matches = 0
+    fallbacks = 0
+
+    print(f"{'File':40} {'Full':>5} {'Fast':>5} {'Conf':>5} {'Full s':>7} {'Fast s':>7}")
+    for file in files:
+        start = time.perf_counter()
+        full_bpm = get_bpm(file)
+        full_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        fast_bpm, confidence = get_bpm_fast(file)
+        fast_time = time.perf_counter() - start
+
+        full_total += full_time
+        fast_total += fast_time
+        matches += abs(full_bpm - fast_bpm) <= tolerance
+        fallbacks += confidence < FAST_MIN_CONFIDENCE
+
+        print(
+            f"{file.name[:40]:40} {full_bpm:5} {fast_bpm:5} {confidence:5.2f} "
+            f"{full_time:7.2f} {fast_time:7.2f}"
+        )
+
+    print(f"\nFiles: {len(files)}")
+    print(f"Full decode: {full_total:.2f}s")
+    print(f"Fast mode:   {fast_total:.2f}s ({full_total / fast_total:.1f}x faster)")
+    print(
+        f"Within ±{tolerance} BPM of full decode: {matches}/{len(files)} "
+        f"({matches / len(files) * 100:.1f}%)"
+    )
+    print(f"Fell back to full decode: {fallbacks}/{len(files)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark fast BPM estimation against full decoding."
+    )
+    parser.add_argument("fixture_dir", nargs="?", default="bench_fixtures")
+    parser.add_argument("--tolerance", type=int, default=2)
+    args = parser.parse_args()
+
+    benchmark(args.fixture_dir, args.tolerance)
@@ -0,0 +1,90 @@
+import argparse
+import random
+import string
+import time
+
+from levenshtein import (
+    levenshtein_distance_ignore_word_order,
+    levenshtein_distances_ignore_word_order,
+)
+
+_rng = random.Random(42)
+WORDS = [
+    "".join(_rng.choices(string.ascii_lowercase, k=_rng.randint(2, 9)))
+    for _ in range(500)
+]
+
+
+def make_pairs(count, seed=0):
+    """
+    Create pairs of normalized names, about half of them near matches.
+    """
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(count):
+        name = " ".join(rng.choices(WORDS, k=rng.randint(3, 7)))
+        if rng.random() < 0.5:
+            # Near match with a few typos
+            chars = list(name)
+            for _ in range(rng.randint(0, 3)):
+                chars[rng.randrange(len(chars))] = rng.choice(string.ascii_lowercase)
+            other = "".join(chars)
+        else:
+            other = " ".join(rng.choices(WORDS, k=rng.randint(3, 7)))
+        pairs.append((name, other))
+    return pairs
+
+
+def benchmark(count, max_distance):
+    pairs = make_pairs(count)
+
+    start = time.perf_counter()
+    full = [levenshtein_distance_ignore_word_order(a, b) for a, b in pairs]
+    full_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bounded = [
+        levenshtein_distance_ignore_word_order(a, b, max_distance=max_distance)
+        for a, b in pairs
+    ]
+    bounded_time = time.perf_counter() - start
+
+    for (a, b), f, d in zip(pairs, full, bounded):
+        expected = f if f <= max_distance else max_distance + 1
+        assert d == expected, f"Mismatch for {a!r} / {b!r}: {f} != {d}"
+
+    within = sum(f <= max_distance for f in full)
+    print(f"Pairs: {count} ({within} within distance {max_distance})")
+    print(f"Full:    {full_time:.3f}s")
+    print(f"Bounded: {bounded_time:.3f}s ({full_time / bounded_time:.1f}x faster)")
+
+    # Rank all other names against a single query, as when re-matching a
+    # library against a cached catalog
+    query = pairs[0][0]
+    candidates = [b for _, b in pairs]
+
+    start = time.perf_counter()
+    single = [levenshtein_distance_ignore_word_order(query, c) for c in candidates]
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch, best_index = levenshtein_distances_ignore_word_order(query, candidates)
+    batch_time = time.perf_counter() - start
+
+    assert list(batch) == single, "Batch distances differ from single distances"
+    assert best_index == single.index(min(single))
+
+    print(f"\nOne query against {count} candidates:")
+    print(f"Pairwise:   {single_time:.3f}s")
+    print(f"Vectorised: {batch_time:.3f}s ({single_time / batch_time:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the bounded Levenshtein distance."
+    )
+    parser.add_argument("--pairs", type=int, default=20000)
+    parser.add_argument("--max-distance", type=int, default=2)
+    args = parser.parse_args()
+
+    benchmark(args.pairs, args.max_distance)
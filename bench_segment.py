@@ -0,0 +1,88 @@
+import argparse
+import io
+import time
+import tracemalloc
+from pathlib import Path
+
+from pydub import AudioSegment
+
+from recognize import extract_audio_segment_ffmpeg
+from tag_scanner import read_mp3_segment
+
+
+def extract_full_decode(file_path, start_sec=30, duration_sec=20):
+    """The previous extraction, decoding the whole file and encoding the segment."""
+    audio = AudioSegment.from_mp3(file_path)
+    segment = audio[start_sec * 1000 : (start_sec + duration_sec) * 1000]
+    buffer = io.BytesIO()
+    segment.export(buffer, format="mp3")
+    return buffer.getvalue()
+
+
+METHODS = {
+    "full": extract_full_decode,
+    "ffmpeg": extract_audio_segment_ffmpeg,
+    "frames": read_mp3_segment,
+}
+
+
+def measure(method, file, start_sec, duration_sec):
+    """
+    Run a method and return its time in seconds and peak Python memory in MB.
+    The memory of the ffmpeg processes is not included.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    method(file, start_sec, duration_sec)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def benchmark(fixture_dir, methods, start_sec=30, duration_sec=20):
+    """
+    Compare the time and memory of extracting the recognition segment from
+    MP3 files by full decode, ffmpeg input seeking and frame slicing.
+    """
+    files = sorted(Path(fixture_dir).rglob("*.mp3"))
+    if not files:
+        print(f"No MP3 files found in {fixture_dir}")
+        return
+
+    totals = {name: [0.0, 0.0] for name in methods}
+
+    header = "".join(f" {name + ' s':>9} {name + ' MB':>9}" for name in methods)
+    print(f"{'File':40}{header}")
+    for file in files:
+        row = f"{file.name[:40]:40}"
+        for name in methods:
+            elapsed, peak = measure(METHODS[name], file, start_sec, duration_sec)
+            totals[name][0] += elapsed
+            totals[name][1] = max(totals[name][1], peak)
+            row += f" {elapsed:9.3f} {peak:9.1f}"
+        print(row)
+
+    print(f"\nFiles: {len(files)}")
+    for name in methods:
+        elapsed, peak = totals[name]
+        print(f"{name:7} {elapsed:8.2f}s total, {peak:7.1f} MB peak Python memory")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark extraction of the recognition segment from MP3 files."
+    )
+    parser.add_argument("fixture_dir", nargs="?", default="bench_fixtures")
+    parser.add_argument(
+        "--methods",
+        nargs="+",
+        choices=METHODS,
+        default=list(METHODS),
+        help="Extraction methods to compare",
+    )
+    parser.add_argument("--start", type=float, default=30)
+    parser.add_argument("--duration", type=float, default=20)
+    args = parser.parse_args()
+
+    benchmark(args.fixture_dir, args.methods, args.start, args.duration)
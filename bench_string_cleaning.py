@@ -0,0 +1,127 @@
+import argparse
+import random
+import re
+import time
+
+from string_cleaning import normalize_string, remove_song_version_info
+
+
+def legacy_remove_song_version_info(song_title: str) -> str:
+    """
+    Previous implementation of remove_song_version_info.
+    """
+    patterns = [
+        r" - Remastered \d{4}",
+        r" \(Remastered \d{4}\)",
+        r" - \d{4} Remaster",
+        r" \(.*?Remaster.*?\)",
+        r" - Remastered$",
+        r" - \d{4} Mix",
+        r" \(\d{4} Mix\)",
+        r" - Radio Edit$",
+        r" \(Radio Edit\)",
+    ]
+    for pattern in patterns:
+        song_title = re.sub(pattern, "", song_title)
+    return song_title.strip()
+
+
+def legacy_normalize_string(input_string: str) -> str:
+    """
+    Previous implementation of normalize_string.
+    """
+    input_string = re.sub(r"&", "and", input_string)
+    input_string = re.sub(r"ä", "ae", input_string)
+    input_string = re.sub(r"ö", "oe", input_string)
+    input_string = re.sub(r"ü", "ue", input_string)
+    input_string = re.sub(r"ß", "ss", input_string)
+    clean_string = re.sub(r"[^a-zA-Z0-9\s]", "", input_string)
+    clean_string = clean_string.lower()
+    clean_string = re.sub(r"\b(the|der|die|das)\b", "", clean_string)
+    normalized_string = re.sub(r"\s+", " ", clean_string).strip()
+    normalized_string = re.sub(r"yusuf cat stevens", "cat stevens", normalized_string)
+    normalized_string = re.sub(
+        r"bob marley and wailers", "bob marley", normalized_string
+    )
+    normalized_string = re.sub(r"\s+", " ", normalized_string).strip()
+    return normalized_string
+
+
+ARTISTS = [
+    "The Beatles",
+    "Die Ärzte",
+    "Bob Marley & The Wailers",
+    "Yusuf / Cat Stevens",
+    "Beyoncé",
+    "Herbert Grönemeyer",
+    "Simon & Garfunkel",
+    "Daft Punk",
+]
+WORDS = ["Love", "Night", "Straße", "Über", "Das", "Song", "Fire", "Ölig", "Mädchen"]
+SUFFIXES = [
+    "",
+    "",
+    "",
+    " - Remastered 2009",
+    " (Remastered 2011)",
+    " - 2015 Remaster",
+    " (Deluxe Remaster Edition)",
+    " - Remastered",
+    " - 1987 Mix",
+    " (2019 Mix)",
+    " - Radio Edit",
+    " (Radio Edit)",
+    " (feat. Someone)",
+]
+
+
+def make_titles(count, seed=0):
+    rng = random.Random(seed)
+    titles = []
+    for _ in range(count):
+        title = " ".join(rng.choices(WORDS, k=rng.randint(1, 4)))
+        titles.append(f"{rng.choice(ARTISTS)} - {title}{rng.choice(SUFFIXES)}")
+    return titles
+
+
+def run(function, titles):
+    start = time.perf_counter()
+    results = [function(title) for title in titles]
+    return results, time.perf_counter() - start
+
+
+def benchmark(count):
+    titles = make_titles(count)
+
+    def legacy(title):
+        return legacy_normalize_string(legacy_remove_song_version_info(title))
+
+    def uncached(title):
+        return normalize_string.__wrapped__(
+            remove_song_version_info.__wrapped__(title)
+        )
+
+    def cached(title):
+        return normalize_string(remove_song_version_info(title))
+
+    legacy_results, legacy_time = run(legacy, titles)
+    uncached_results, uncached_time = run(uncached, titles)
+    cached_results, cached_time = run(cached, titles)
+
+    assert uncached_results == legacy_results, "Uncached output differs"
+    assert cached_results == legacy_results, "Cached output differs"
+
+    print(f"Titles: {count} ({len(set(titles))} unique)")
+    print(f"Legacy:   {legacy_time:.3f}s")
+    print(f"Compiled: {uncached_time:.3f}s ({legacy_time / uncached_time:.1f}x faster)")
+    print(f"Cached:   {cached_time:.3f}s ({legacy_time / cached_time:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark string normalization against the previous implementation."
+    )
+    parser.add_argument("--titles", type=int, default=200000)
+    args = parser.parse_args()
+
+    benchmark(args.titles)
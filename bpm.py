@@ -1,5 +1,26 @@
+import math
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
 import librosa
 
+# Maximum number of seconds the BPM detection of a single file may take
+BPM_TIMEOUT = 120
+
+# Fast mode analyses a few windows of the track instead of the whole file
+FAST_WINDOWS = 3
+FAST_WINDOW_DURATION = 20  # seconds
+# Relative tempo difference up to which two windows are considered to agree
+FAST_TOLERANCE = 0.04
+# Fraction of agreeing windows below which the whole track is analysed
+FAST_MIN_CONFIDENCE = 0.6
+
+
+class BpmTimeoutError(Exception):
+    pass
+
 
 def get_bpm(audio_path):
     """
@@ -13,3 +34,186 @@ def get_bpm(audio_path):
 
     # Extract scalar value from tempo array and convert to float
     return round(float(tempo.item()))
+
+
+def get_bpm_fast(
+    audio_path,
+    windows=FAST_WINDOWS,
+    window_duration=FAST_WINDOW_DURATION,
+    min_confidence=FAST_MIN_CONFIDENCE,
+):
+    """
+    Estimate BPM of an audio file by only decoding a few evenly spaced windows.
+
+    Falls back to analysing the whole track if the windows disagree.
+
+    Returns:
+        (bpm, confidence) where confidence is the fraction of windows that agree
+        with the median tempo. A confidence below min_confidence means the BPM
+        was calculated from the whole track.
+    """
+    duration = librosa.get_duration(path=audio_path)
+
+    # Short tracks are cheap to analyse completely
+    if duration <= windows * window_duration * 1.5:
+        return get_bpm(audio_path), 1.0
+
+    tempos = []
+    for i in range(windows):
+        # Center the windows at 1/4, 2/4, 3/4 of the track to skip intro and outro
+        center = duration * (i + 1) / (windows + 1)
+        y, sr = librosa.load(
+            audio_path,
+            sr=11025,
+            offset=max(0.0, center - window_duration / 2),
+            duration=window_duration,
+        )
+        tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
+        tempos.append(float(tempo.item()))
+
+    median = sorted(tempos)[len(tempos) // 2]
+    agreeing = [t for t in tempos if abs(t - median) <= median * FAST_TOLERANCE]
+    confidence = len(agreeing) / len(tempos)
+
+    if confidence < min_confidence:
+        return get_bpm(audio_path), confidence
+
+    return round(sum(agreeing) / len(agreeing)), confidence
+
+
+def _raise_timeout(signum, frame):
+    raise BpmTimeoutError("BPM detection timed out")
+
+
+def _get_bpm_with_timeout(audio_path, timeout, fast):
+    """
+    Calculate BPM inside a worker process, aborting after timeout seconds.
+    Timeouts are only supported on platforms with SIGALRM.
+    """
+    use_alarm = timeout and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.alarm(math.ceil(timeout))
+    try:
+        if fast:
+            return get_bpm_fast(audio_path)[0]
+        return get_bpm(audio_path)
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+
+
+def _run_pool(audio_paths, workers, timeout, fast):
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = {
+            executor.submit(
+                _get_bpm_with_timeout, audio_path, timeout, fast
+            ): audio_path
+            for audio_path in audio_paths
+        }
+        for future in as_completed(futures):
+            audio_path = futures[future]
+            try:
+                yield audio_path, future.result(), None
+            except Exception as e:
+                yield audio_path, None, e
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_bpm_batch(audio_paths, workers=None, timeout=BPM_TIMEOUT, fast=False):
+    """
+    Calculate BPM of many audio files in parallel using a process pool.
+
+    Args:
+        audio_paths: Paths of the audio files to analyse.
+        workers: Number of worker processes, defaults to the number of CPUs.
+        timeout: Maximum number of seconds to spend on a single file.
+        fast: Use get_bpm_fast instead of analysing the whole track.
+
+    Yields:
+        (audio_path, bpm, error) tuples in the order the files finish. bpm is
+        None and error is the raised exception if the detection failed.
+    """
+    order = {audio_path: i for i, audio_path in enumerate(audio_paths)}
+    remaining = list(audio_paths)
+
+    while remaining:
+        crashed = []
+        for audio_path, bpm, error in _run_pool(remaining, workers, timeout, fast):
+            if isinstance(error, BrokenProcessPool):
+                crashed.append(audio_path)
+            else:
+                yield audio_path, bpm, error
+
+        if not crashed:
+            return
+
+        crashed.sort(key=order.get)
+        if workers == 1:
+            # A single worker runs the files in order, so the first file that
+            # did not finish is the one that took the worker process down
+            yield crashed[0], None, BrokenProcessPool("Worker process crashed")
+            crashed = crashed[1:]
+
+        # Retry the files that were lost with the pool one at a time to find
+        # the file that crashed the worker
+        remaining = crashed
+        workers = 1
+
+
+class BpmPool:
+    """
+    Process pool for detecting the BPM of single files from multiple threads.
+
+    If a worker process crashes, the pool is restarted and the files that were
+    being analysed at that time are retried one at a time in a separate
+    process, so only the file that crashed the worker fails.
+    """
+
+    def __init__(self, workers=None, timeout=BPM_TIMEOUT, fast=False):
+        self.workers = workers
+        self.timeout = timeout
+        self.fast = fast
+        self.lock = threading.Lock()
+        self.isolation_lock = threading.Lock()
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+
+    def _restart(self, executor):
+        with self.lock:
+            if self.executor is executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def get_bpm(self, audio_path):
+        while True:
+            with self.lock:
+                executor = self.executor
+            try:
+                future = executor.submit(
+                    _get_bpm_with_timeout, audio_path, self.timeout, self.fast
+                )
+            except BrokenProcessPool:
+                # The pool broke before the file was submitted
+                self._restart(executor)
+                continue
+            try:
+                return future.result()
+            except BrokenProcessPool:
+                self._restart(executor)
+                break
+
+        # Any of the files in flight may have crashed the worker
+        with self.isolation_lock:
+            executor = ProcessPoolExecutor(max_workers=1)
+            try:
+                return executor.submit(
+                    _get_bpm_with_timeout, audio_path, self.timeout, self.fast
+                ).result()
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        with self.lock:
+            self.executor.shutdown(cancel_futures=True)
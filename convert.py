@@ -0,0 +1,127 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from mutagen.mp3 import MP3
+from pydub import AudioSegment
+from tqdm import tqdm
+
+CONVERTIBLE_EXTENSIONS = [".flac", ".m4a"]
+# None leaves the choice to ffmpeg, which uses libmp3lame at 128k
+DEFAULT_BITRATE = None
+DEFAULT_CODEC = None
+# Maximum difference in seconds between the durations of original and MP3
+DURATION_TOLERANCE = 1.0
+
+
+class ConversionError(Exception):
+    pass
+
+
+def verify_mp3(mp3_file: Path, expected_duration: float):
+    """
+    Check that a file is a readable MP3 with the expected duration.
+    """
+    try:
+        duration = MP3(mp3_file).info.length
+    except Exception as e:
+        raise ConversionError(f"Converted file is not a valid MP3: {e}")
+
+    if abs(duration - expected_duration) > DURATION_TOLERANCE:
+        raise ConversionError(
+            f"Converted file is {duration:.1f}s long, expected {expected_duration:.1f}s"
+        )
+
+
+def convert_to_mp3(
+    file: Path, bitrate: str = DEFAULT_BITRATE, codec: str = DEFAULT_CODEC
+) -> Path:
+    """
+    Converts a file to mp3 and deletes the original file.
+
+    The MP3 is written to a temporary file that is only renamed to its final
+    name after it was verified. The original is deleted after that.
+    """
+    file = Path(file)
+    mp3_file = file.with_suffix(".mp3")
+    temp_file = file.with_name(f"{file.stem}.mp3.part")
+
+    audio = AudioSegment.from_file(file, format=file.suffix[1:])
+    try:
+        audio.export(temp_file, format="mp3", bitrate=bitrate, codec=codec)
+        verify_mp3(temp_file, len(audio) / 1000)
+        os.replace(temp_file, mp3_file)
+    except BaseException:
+        temp_file.unlink(missing_ok=True)
+        raise
+    print(f"Converted: {file.name} -> {mp3_file.name}")
+
+    file.unlink()
+    print(f"Deleted: {file}")
+
+    return mp3_file
+
+
+def convert_files(
+    files: list,
+    workers: int = None,
+    bitrate: str = DEFAULT_BITRATE,
+    codec: str = DEFAULT_CODEC,
+):
+    """
+    Convert many files to mp3 in parallel using a process pool.
+
+    Yields:
+        (file, mp3_file, error) tuples in the order the files finish. mp3_file
+        is None and error the raised exception if the conversion failed.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(convert_to_mp3, file, bitrate, codec): file
+            for file in files
+        }
+        for future in as_completed(futures):
+            file = futures[future]
+            try:
+                yield file, future.result(), None
+            except Exception as e:
+                yield file, None, e
+
+
+def convert_library(
+    music_dir="music",
+    workers: int = None,
+    bitrate: str = DEFAULT_BITRATE,
+    codec: str = DEFAULT_CODEC,
+):
+    """
+    Convert all FLAC and M4A files in a directory to mp3.
+    """
+    files = [
+        file
+        for file in Path(music_dir).glob("**/*.*")
+        if file.suffix.lower() in CONVERTIBLE_EXTENSIONS
+    ]
+
+    for file, _, error in tqdm(
+        convert_files(files, workers=workers, bitrate=bitrate, codec=codec),
+        total=len(files),
+        desc="Converting files",
+        unit="file",
+    ):
+        if error is not None:
+            print(f"Failed to convert {file.name}: {error}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert all FLAC and M4A files in the library to MP3."
+    )
+    parser.add_argument("music_dir", nargs="?", default="music")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--bitrate", default=DEFAULT_BITRATE, help="e.g. 320k")
+    parser.add_argument("--codec", default=DEFAULT_CODEC, help="e.g. libmp3lame")
+    args = parser.parse_args()
+
+    convert_library(args.music_dir, args.workers, args.bitrate, args.codec)
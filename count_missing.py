@@ -1,10 +1,8 @@
-import os
+import argparse
 from collections import defaultdict
 from datetime import timedelta
 
-from mutagen.easyid3 import EasyID3
-from mutagen.mp3 import MP3
-from tqdm import tqdm
+from library_index import LibraryIndex
 
 
 def format_duration(seconds):
@@ -12,46 +10,45 @@ def format_duration(seconds):
     return str(duration)
 
 
-def count_missing_website_tags(music_dir="music"):
+def format_record(record):
+    if record.duration is None:
+        return f"{record.path} [Duration unavailable]"
+    return f"{record.path} [{format_duration(record.duration)}]"
+
+
+def count_missing_website_tags(music_dir="music", acoustic=False, workers=None):
+    """
+    Report files without a website tag and files sharing one. If acoustic is
+    True, files that sound the same are found with the fingerprint index too.
+    """
     # Lists to store files with and without website tags
     missing_website = []
     has_website = []
     # Dictionary to store files by website value
     website_groups = defaultdict(list)
 
-    # Get all MP3 files recursively
-    mp3_files = []
-    for root, dirs, files in os.walk(music_dir):
-        for file in files:
-            if file.lower().endswith(".mp3"):
-                mp3_files.append(os.path.join(root, file))
-
-    # Process each file with progress bar
-    for mp3_path in tqdm(mp3_files, desc="Checking website tags"):
-        try:
-            audio = EasyID3(mp3_path)
-            if "website" not in audio:
-                missing_website.append(mp3_path)
-            else:
-                has_website.append(mp3_path)
-                # Group files by website value
-                website_value = audio["website"][0]
-                website_groups[website_value].append(mp3_path)
-        except Exception as e:
-            print(f"Error processing {mp3_path}: {str(e)}")
+    # Get the tags of all MP3 files from the library index
+    index = LibraryIndex()
+    records = index.scan(music_dir, desc="Checking website tags")
+    index.close()
+
+    for record in records:
+        if record.error:
+            print(f"Error processing {record.path}: {record.error}")
+        elif not record.website:
+            missing_website.append(record)
+        else:
+            has_website.append(record)
+            # Group files by website value
+            website_groups[record.website].append(record)
 
     # Handle missing website tags
     print("\nFiles missing website tag:")
-    for file in missing_website:
-        try:
-            mp3 = MP3(file)
-            duration = format_duration(mp3.info.length)
-            print(f"\n- {file} [{duration}]")
-        except Exception as e:
-            print(f"\n- {file} [Duration unavailable: {str(e)}]")
+    for record in missing_website:
+        print(f"\n- {format_record(record)}")
 
     # Print statistics
-    total_files = len(mp3_files)
+    total_files = len(records)
     missing_count = len(missing_website)
     has_count = len(has_website)
     unique_websites = len(website_groups)
@@ -66,22 +63,63 @@ def count_missing_website_tags(music_dir="music"):
 
     # Print duplicate statistics
     print("\nDuplicate Analysis:")
-    duplicates = {url: files for url, files in website_groups.items() if len(files) > 1}
+    duplicates = {
+        url: records for url, records in website_groups.items() if len(records) > 1
+    }
     if duplicates:
         print(f"\nFound {len(duplicates)} website values with multiple files:")
-        for website, files in duplicates.items():
+        for website, records in duplicates.items():
             print(f"\nWebsite: {website}")
-            print(f"Number of files: {len(files)}")
-            for file in files:
-                try:
-                    mp3 = MP3(file)
-                    duration = format_duration(mp3.info.length)
-                    print(f"- {file} [{duration}]")
-                except Exception as e:
-                    print(f"- {file} [Duration unavailable: {str(e)}]")
+            print(f"Number of files: {len(records)}")
+            for record in records:
+                print(f"- {format_record(record)}")
     else:
         print("No duplicates found (no website values appear multiple times)")
 
+    if acoustic:
+        print_acoustic_duplicates(records, workers)
+
+
+def print_acoustic_duplicates(records, workers=None):
+    """Print groups of files that sound the same, whatever their tags."""
+    # Imported here, so reports without fingerprints do not load librosa
+    from fingerprint_index import FingerprintIndex
+
+    index = FingerprintIndex()
+    index.update(records, workers=workers)
+    groups = index.duplicates()
+    index.close()
+
+    print("\nAcoustic Duplicate Analysis:")
+    if not groups:
+        print("No files sound the same")
+        return
+
+    by_path = {record.path: record for record in records}
+    print(f"\nFound {len(groups)} groups of files that sound the same:")
+    for group in groups:
+        print(f"\nNumber of files: {len(group)}")
+        for path in group:
+            record = by_path.get(path)
+            print(f"- {format_record(record) if record else path}")
+
 
 if __name__ == "__main__":
-    count_missing_website_tags()
+    parser = argparse.ArgumentParser(
+        description="Report missing website tags and duplicate files."
+    )
+    parser.add_argument("music_dir", nargs="?", default="music")
+    parser.add_argument(
+        "--acoustic",
+        action="store_true",
+        help="Also find files that sound the same using audio fingerprints",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes fingerprinting files (default: number of CPUs)",
+    )
+    args = parser.parse_args()
+
+    count_missing_website_tags(args.music_dir, args.acoustic, args.workers)
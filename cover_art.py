@@ -0,0 +1,214 @@
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from track_records import SpotifyTrack
+
+COVER_ART_DIR = Path("cover_art")
+# Seconds to wait for the server when downloading a cover
+DOWNLOAD_TIMEOUT = 30
+# Number of covers downloaded at once when prefetching
+PREFETCH_WORKERS = 8
+# JPEG quality of downscaled covers
+EMBED_QUALITY = 85
+
+
+def _jpeg_end(data: bytes) -> int:
+    """
+    Find the end of the JPEG image at the start of data by following its
+    segments. Returns the position after the EOI marker, or -1 if the image is
+    truncated or malformed.
+    """
+    position = 2
+    while position + 2 <= len(data):
+        if data[position] != 0xFF:
+            return -1
+        marker = data[position + 1]
+        if marker == 0xD9:
+            return position + 2
+        if marker == 0xFF:
+            # Fill byte before a marker
+            position += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            # Markers without a segment
+            position += 2
+            continue
+        position += 2 + int.from_bytes(data[position + 2 : position + 4], "big")
+        if marker == 0xDA:
+            # The compressed data of a scan ends at the first marker that is
+            # not a stuffed 0xFF byte or a restart marker
+            while True:
+                position = data.find(b"\xff", position)
+                if position == -1 or position + 1 >= len(data):
+                    return -1
+                following = data[position + 1]
+                if following == 0x00 or 0xD0 <= following <= 0xD7:
+                    position += 2
+                elif following == 0xFF:
+                    position += 1
+                else:
+                    break
+    return -1
+
+
+def is_valid_jpeg(path: Path) -> bool:
+    """
+    Check that a file is a complete JPEG image. Bytes after the end of the
+    image are allowed, many JPEGs have them.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return False
+    return data.startswith(b"\xff\xd8") and _jpeg_end(data) != -1
+
+
+def write_atomic(path: Path, data: bytes):
+    """
+    Write a file so that it either has the full content or does not exist.
+    """
+    temp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+
+class CoverArtStore:
+    """
+    Downloads album covers to cover_art/{album_id}.jpg.
+
+    Every distinct image is stored once in cover_art/by_hash/ and the album
+    files are hard links to it. Concurrent requests for the same album share a
+    single download, and files are written atomically so an interrupted
+    download never leaves a broken cover behind.
+    """
+
+    def __init__(self, directory: Path = COVER_ART_DIR, workers=PREFETCH_WORKERS):
+        self.directory = Path(directory)
+        self.hash_directory = self.directory / "by_hash"
+        self.hash_directory.mkdir(parents=True, exist_ok=True)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_maxsize=workers,
+            max_retries=Retry(
+                total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504]
+            ),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def close(self):
+        self.executor.shutdown()
+        self.session.close()
+
+    def path(self, album_id: str) -> Path:
+        return self.directory / f"{album_id}.jpg"
+
+    def get(self, track: SpotifyTrack) -> Path:
+        """
+        Get the path of the cover of a track's album, downloading it if needed.
+        """
+        album_id = track.album_id
+        path = self.path(album_id)
+        if is_valid_jpeg(path):
+            return path
+
+        with self.lock:
+            future = self.in_flight.get(album_id)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.in_flight[album_id] = future
+
+        if owner:
+            try:
+                if track.cover_url is None:
+                    raise ValueError(f"Album {album_id} has no cover")
+                self._download(track.cover_url, path)
+                future.set_result(path)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self.lock:
+                    del self.in_flight[album_id]
+
+        return future.result()
+
+    def get_resized(self, track: SpotifyTrack, size: int) -> Path:
+        """
+        Get the path of the cover of a track's album scaled down to fit into
+        size x size pixels. It is created once per album in cover_art/<size>px/.
+        """
+        path = self.directory / f"{size}px" / f"{track.album_id}.jpg"
+        if is_valid_jpeg(path):
+            return path
+
+        with Image.open(self.get(track)) as image:
+            image.draft("RGB", (size, size))
+            image = image.convert("RGB")
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            data = io.BytesIO()
+            image.save(data, format="JPEG", quality=EMBED_QUALITY, optimize=True)
+
+        path.parent.mkdir(exist_ok=True)
+        write_atomic(path, data.getvalue())
+        return path
+
+    def prefetch(self, tracks: list):
+        """
+        Start downloading the covers of all albums of the tracks in the background.
+        """
+        albums = {}
+        for track in tracks:
+            if track is not None and track.cover_url:
+                albums.setdefault(track.album_id, track)
+
+        for track in albums.values():
+            if not is_valid_jpeg(self.path(track.album_id)):
+                self.executor.submit(self.get, track)
+
+    def _download(self, url: str, path: Path):
+        response = self.session.get(url, timeout=DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+        data = response.content
+        if not data.startswith(b"\xff\xd8"):
+            raise ValueError(f"Cover art at {url} is not a JPEG image")
+        # Decode the whole image, verify() does not notice truncated images
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.load()
+        except Exception as e:
+            raise ValueError(f"Cover art at {url} is not a valid image: {e}")
+
+        hash_path = self.hash_directory / f"{hashlib.sha1(data).hexdigest()}.jpg"
+        if not is_valid_jpeg(hash_path):
+            write_atomic(hash_path, data)
+
+        # Link the album to the stored image, falling back to a copy on file
+        # systems without hard links
+        temp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        try:
+            os.link(hash_path, temp_path)
+            os.replace(temp_path, path)
+        except OSError:
+            temp_path.unlink(missing_ok=True)
+            write_atomic(path, data)
@@ -1,111 +1,276 @@
+import argparse
+import colorsys
 import io
-import os
 import random
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
 from pathlib import Path
 
-from mutagen import File
+import numpy as np
+from mutagen.id3 import ID3
 from PIL import Image
 
+from cover_art import write_atomic
+from library_index import LibraryIndex
+from safe_json import load_dict_from_json, save_dict_to_json
 
-def get_mp3_files(music_dir):
-    """Recursively find all MP3 files in the given directory."""
-    mp3_files = []
-    for root, _, files in os.walk(music_dir):
-        for file in files:
-            if file.lower().endswith(".mp3"):
-                mp3_files.append(os.path.join(root, file))
-    return mp3_files
 
+# Thumbnails of embedded covers by size and cover hash
+THUMBNAIL_DIR = Path("cover_art/thumbnails")
+# Dominant colours of the covers by cover hash
+COLOR_CACHE_PATH = THUMBNAIL_DIR / "colors.json"
+# Number of covers extracted from MP3 files at once
+EXTRACT_WORKERS = 8
+# Size covers are scaled down to before finding their dominant colour
+COLOR_SAMPLE_SIZE = 64
+# Colours with a lower saturation are treated as greys
+MIN_SATURATION = 0.15
+COLLAGE_ORDERS = ("random", "year", "bpm", "color")
 
-def extract_cover_art(mp3_path):
-    """Extract cover art from MP3 file. Returns PIL Image or None if no cover art found."""
-    try:
-        audio = File(mp3_path)
-
-        # Try different tag formats
-        if hasattr(audio, "tags"):
-            # ID3 tags (MP3)
-            if "APIC:" in audio.tags:
-                artwork = audio.tags["APIC:"].data
-                return Image.open(io.BytesIO(artwork))
-            elif "APIC:Cover" in audio.tags:
-                artwork = audio.tags["APIC:Cover"].data
-                return Image.open(io.BytesIO(artwork))
 
-        return None
+def get_covers(music_dir):
+    """Find all MP3 files with embedded cover art using the library index."""
+    index = LibraryIndex()
+    records = index.scan(music_dir)
+    index.close()
+    return [record for record in records if record.has_cover and record.cover_hash]
+
+
+def distinct_covers(records):
+    """
+    One record per distinct cover, so large albums do not fill the collage.
+    Its year is the earliest and its BPM the median of the files with the cover.
+    """
+    albums = {}
+    for record in records:
+        albums.setdefault(record.cover_hash, []).append(record)
+
+    covers = []
+    for album in albums.values():
+        years = [record.year for record in album if record.year]
+        bpms = [record.bpm for record in album if record.bpm]
+        covers.append(
+            album[0]._replace(
+                year=min(years) if years else None,
+                bpm=float(np.median(bpms)) if bpms else None,
+            )
+        )
+    return covers
+
+
+def extract_cover_art(mp3_path, size=None):
+    """
+    Extract cover art from MP3 file. Returns PIL Image or None if no cover art found.
+    If size is given, the JPEG is decoded at the smallest scale that is at least
+    size pixels large, which is much faster than decoding the full image.
+    """
+    try:
+        pictures = ID3(mp3_path).getall("APIC")
+        if not pictures:
+            return None
+        image = Image.open(io.BytesIO(pictures[0].data))
+        if size:
+            image.draft("RGB", (size, size))
+        return image.convert("RGB")
     except Exception as e:
         print(f"Error extracting cover art from {mp3_path}: {e}")
         return None
 
 
-def create_cover_collage(music_dir, output_path, grid_size=9):
-    """Create a collage of album covers in a grid."""
+def load_thumbnail(record, size):
+    """
+    Get the cover of a file scaled to fit into size x size pixels. Thumbnails
+    are cached by cover, so files of the same album share one thumbnail.
+    """
+    thumbnail_path = THUMBNAIL_DIR / str(size) / f"{record.cover_hash}.jpg"
+    if thumbnail_path.exists():
+        with Image.open(thumbnail_path) as thumbnail:
+            return thumbnail.convert("RGB")
+
+    cover = extract_cover_art(record.path, size)
+    if cover is None:
+        return None
+    cover.thumbnail((size, size), Image.Resampling.LANCZOS)
+
+    data = io.BytesIO()
+    cover.save(data, format="JPEG", quality=95)
+    thumbnail_path.parent.mkdir(parents=True, exist_ok=True)
+    write_atomic(thumbnail_path, data.getvalue())
+    return cover
+
+
+def pick_without_replacement(items):
+    """Yield the items in random order, each pick taking constant time."""
+    items = list(items)
+    while items:
+        index = random.randrange(len(items))
+        # Move the last item into the gap instead of shifting all others
+        items[index], items[-1] = items[-1], items[index]
+        yield items.pop()
+
+
+def dominant_color(image):
+    """
+    Most common colour of an image. Pixels are counted in a 16x16x16 grid of
+    the RGB cube and the mean of the pixels in the fullest cell is returned.
+    """
+    sample = image.copy()
+    sample.thumbnail((COLOR_SAMPLE_SIZE, COLOR_SAMPLE_SIZE))
+    pixels = np.asarray(sample.convert("RGB")).reshape(-1, 3)
+
+    cells = (pixels >> 4).astype(np.intp)
+    keys = cells[:, 0] << 8 | cells[:, 1] << 4 | cells[:, 2]
+    fullest = np.bincount(keys, minlength=4096).argmax()
+    return [round(value) for value in pixels[keys == fullest].mean(axis=0)]
+
+
+def color_sort_key(color):
+    """Sort colours by hue, followed by greys from light to dark."""
+    hue, saturation, value = colorsys.rgb_to_hsv(*(channel / 255 for channel in color))
+    if saturation < MIN_SATURATION:
+        return (1, -value)
+    return (0, hue, -value)
+
+
+def load_covers(picks, count, size):
+    """
+    Yield (record, cover) for count of the picked records as soon as their
+    covers are loaded. Records without a readable cover are replaced by the
+    next pick.
+    """
+    with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as executor:
+        pending = {
+            executor.submit(load_thumbnail, record, size): record
+            for record in islice(picks, count)
+        }
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                record = pending.pop(future)
+                cover = future.result()
+                if cover is not None:
+                    yield record, cover
+                    continue
+
+                # Try another file for this position
+                record = next(picks, None)
+                if record is None:
+                    print("Warning: Ran out of files to try for this position!")
+                    continue
+                pending[executor.submit(load_thumbnail, record, size)] = record
+
+
+def sort_covers(covers, order):
+    """Sort the loaded (record, cover) pairs, covers without a value last."""
+    if order == "year":
+        covers.sort(key=lambda item: (item[0].year is None, item[0].year or 0))
+    elif order == "bpm":
+        covers.sort(key=lambda item: (item[0].bpm is None, item[0].bpm or 0))
+    elif order == "color":
+        colors = {}
+        if COLOR_CACHE_PATH.exists():
+            colors = load_dict_from_json(COLOR_CACHE_PATH)
+        missing = [item for item in covers if item[0].cover_hash not in colors]
+        for record, cover in missing:
+            colors[record.cover_hash] = dominant_color(cover)
+        if missing:
+            save_dict_to_json(colors, COLOR_CACHE_PATH)
+        covers.sort(key=lambda item: color_sort_key(colors[item[0].cover_hash]))
+
+
+def create_cover_collage(
+    music_dir, output_path, grid_size=9, order="random", distinct=True
+):
+    """
+    Create a collage of album covers in a grid. Unless distinct is False, every
+    cover is used at most once. The covers are placed randomly or sorted by
+    year, BPM or dominant colour from the top left to the bottom right.
+    """
     # Final image dimensions
     FINAL_SIZE = 2700
     COVER_SIZE = FINAL_SIZE // grid_size  # Size of each cover art
 
-    # Get all MP3 files
-    mp3_files = get_mp3_files(music_dir)
+    # Get all MP3 files with cover art
+    records = get_covers(music_dir)
+    if distinct:
+        records = distinct_covers(records)
 
-    if len(mp3_files) < grid_size * grid_size:
+    if len(records) < grid_size * grid_size:
+        source = "album covers" if distinct else "MP3 files with cover art"
         raise ValueError(
-            f"Not enough MP3 files. Found {len(mp3_files)}, need {grid_size * grid_size}"
+            f"Not enough {source}. Found {len(records)}, need {grid_size * grid_size}"
         )
 
-    # Create a copy of mp3_files to draw from
-    available_files = mp3_files.copy()
+    picks = pick_without_replacement(records)
+    covers = load_covers(picks, grid_size * grid_size, COVER_SIZE)
+    if order != "random":
+        # All covers are needed before the first one can be placed
+        covers = list(covers)
+        sort_covers(covers, order)
 
     # Create new image with white background
     collage = Image.new("RGB", (FINAL_SIZE, FINAL_SIZE), "white")
 
-    # Process each grid position
-    for index in range(grid_size * grid_size):
+    for index, (_, cover) in enumerate(covers):
         # Calculate position in grid
         row = index // grid_size
         col = index % grid_size
 
-        cover = None
-        while cover is None and available_files:
-            # Get a random file
-            mp3_path = random.choice(available_files)
-            available_files.remove(mp3_path)  # Remove to avoid picking it again
-
-            # Try to extract cover
-            cover = extract_cover_art(mp3_path)
-
-            if not cover:
-                print(f"No cover art found for: {mp3_path}, trying another file...")
-
-        if not cover:
-            print("Warning: Ran out of files to try for this position!")
-            continue
-
-        # Resize cover art maintaining aspect ratio
-        cover.thumbnail((COVER_SIZE, COVER_SIZE), Image.Resampling.LANCZOS)
-
-        # Create white background for this cell
-        cell = Image.new("RGB", (COVER_SIZE, COVER_SIZE), "white")
-
-        # Calculate position to center cover in cell
-        x = (COVER_SIZE - cover.width) // 2
-        y = (COVER_SIZE - cover.height) // 2
-
-        # Paste cover onto cell
-        cell.paste(cover, (x, y))
-
-        # Paste cell onto main image
-        collage.paste(cell, (col * COVER_SIZE, row * COVER_SIZE))
+        # Center cover in its cell
+        x = col * COVER_SIZE + (COVER_SIZE - cover.width) // 2
+        y = row * COVER_SIZE + (COVER_SIZE - cover.height) // 2
+        collage.paste(cover, (x, y))
 
     # Save the final collage
     collage.save(output_path, quality=95)
     print(f"Collage saved to: {output_path}")
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Create a collage of the album covers of the library."
+    )
+    parser.add_argument(
+        "music_dir",
+        nargs="?",
+        default="music/",
+        help="Directory of the music library",
+    )
+    parser.add_argument(
+        "--output",
+        default="cover_collage.jpg",
+        help="Path of the collage image",
+    )
+    parser.add_argument(
+        "--grid-size",
+        type=int,
+        default=9,
+        help="Number of covers per row and column",
+    )
+    parser.add_argument(
+        "--order",
+        choices=COLLAGE_ORDERS,
+        default="random",
+        help="Order of the covers from the top left to the bottom right",
+    )
+    parser.add_argument(
+        "--all-files",
+        action="store_true",
+        help="Pick files instead of distinct covers, so albums can repeat",
+    )
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    music_dir = "music/"  # Replace with your music directory path
-    output_path = "cover_collage.jpg"
+    args = parse_args()
 
     try:
-        create_cover_collage(music_dir, output_path)
+        create_cover_collage(
+            args.music_dir,
+            args.output,
+            grid_size=args.grid_size,
+            order=args.order,
+            distinct=not args.all_files,
+        )
     except Exception as e:
         print(f"Error creating collage: {e}")
@@ -1,12 +1,16 @@
+import hashlib
 import os
+from functools import lru_cache
 from pathlib import Path
 
+import numpy as np
 import spotipy
-from mutagen.easyid3 import EasyID3
-from mutagen.id3 import ID3
 from spotipy.oauth2 import SpotifyOAuth
 
-from spotify_track_id import extract_spotify_track_id
+from library_index import LibraryIndex
+from playlist_rules import Bin, BinRule, GroupRule, Playlist, evaluate_rules
+from playlist_sync import PlaylistSync
+from track_records import TrackTable
 
 
 def get_activity_description(bpm):
@@ -28,49 +32,134 @@ def get_activity_description(bpm):
     return "General workout playlist"
 
 
-def get_year_from_id3(audio_id3, file_path):
-    """Extract year from ID3 tags, returns None if year is invalid or before 1960."""
-    try:
-        # Try TYER tag first
-        if "TYER" in audio_id3 and audio_id3["TYER"].text[0]:
-            year = int(str(audio_id3["TYER"].text[0]).strip())
-        # Fall back to TDRC if TYER is not available
-        elif "TDRC" in audio_id3 and audio_id3["TDRC"].text[0]:
-            year = int(str(audio_id3["TDRC"].text[0]).split("-")[0])
-        else:
-            return None
-
-        return year if year >= 1960 else None
-    except (ValueError, TypeError, IndexError):
-        print(f"Invalid year format in tags for {file_path}")
-        return None
-
-
-def create_m3u_playlist(name, file_paths, output_dir="playlists"):
-    """Create an M3U playlist file with the given name and tracks."""
+# Playlists created from the library, in this order
+PLAYLIST_RULES = [
+    # Each track is in the first workout playlist within 5 BPM of its tempo
+    BinRule(
+        "bpms",
+        [
+            Bin(bpm - 5, bpm + 5, f"Workout {bpm} BPM", get_activity_description(bpm))
+            for bpm in (110, 120, 130, 140, 150, 160)
+        ],
+    ),
+    # Ignoring invalid years and years before 1960
+    GroupRule(
+        key=lambda table: table.years // 10 * 10,
+        where=lambda table: table.years >= 1960,
+        name="Music from the {}s",
+        description="Collection of tracks from the {}s",
+    ),
+    # Skipping the root music directory
+    GroupRule(
+        key=lambda table: table.folders,
+        where=lambda table: table.folders != "music",
+        name="{}",
+        description="Music from the {} folder",
+    ),
+]
+
+
+ALL_SONGS = "All Songs"
+
+
+@lru_cache(maxsize=None)
+def relative_path(path, start):
+    """Relative path of a song, cached as songs are in many playlists."""
+    return os.path.relpath(path, start=start)
+
+
+def m3u_entry(table, row, output_path):
+    """Extended M3U entry of a track with its duration, artist and title."""
+    duration = table.durations[row]
+    seconds = -1 if np.isnan(duration) else round(duration)
+    artist, title = table.artists[row], table.titles[row]
+    if artist and title:
+        display_name = f"{artist} - {title}"
+    else:
+        display_name = Path(table.paths[row]).stem
+    rel_path = relative_path(table.paths[row], output_path)
+    return f"#EXTINF:{seconds},{display_name}\n{rel_path}\n"
+
+
+def create_m3u_playlist(name, table, rows, output_dir="playlists"):
+    """
+    Create an M3U playlist file with the given name and rows of the table.
+
+    The file is only written if its content changed, so media servers watching
+    the directory do not rescan unchanged playlists. It is written to a
+    temporary file first and then renamed, so it is never seen half written.
+    """
     # Create playlists directory if it doesn't exist
     output_path = Path(output_dir)
     output_path.mkdir(exist_ok=True)
 
-    # Create m3u file
+    content = "#EXTM3U\n" + "".join(
+        m3u_entry(table, row, str(output_path)) for row in rows
+    )
+    data = content.encode("utf-8")
+
     playlist_path = output_path / f"{name}.m3u"
-    with open(playlist_path, "w", encoding="utf-8") as f:
-        f.write("#EXTM3U\n")
-        for path in file_paths:
-            # Convert to relative path from playlist location to song
-            rel_path = os.path.relpath(path, start=output_path)
-            f.write(f"{rel_path}\n")
+    try:
+        existing_hash = hashlib.sha1(playlist_path.read_bytes()).digest()
+    except FileNotFoundError:
+        existing_hash = None
+    if existing_hash == hashlib.sha1(data).digest():
+        return
+
+    temp_path = playlist_path.with_name(f".{playlist_path.name}.tmp")
+    try:
+        temp_path.write_bytes(data)
+        os.replace(temp_path, playlist_path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
 
     print(f"Created M3U playlist: {playlist_path}")
 
 
+def sync_rule_playlists(
+    playlist_sync: PlaylistSync,
+    table: TrackTable,
+    rules=PLAYLIST_RULES,
+    output_dir="playlists",
+):
+    """
+    Sync the playlists of the rules to Spotify and write their M3U files.
+
+    Playlists without tracks are only synced if they were synced before, so
+    their old tracks are removed. This includes groups that no longer exist,
+    e.g. of a removed folder.
+    """
+    synced_before = playlist_sync.synced_playlists()
+    playlists = evaluate_rules(rules, table)
+    names = {playlist.name for playlist in playlists}
+    playlists += [
+        Playlist(name, "", np.empty(0, dtype=int))
+        for name in sorted(synced_before)
+        if name not in names and name != ALL_SONGS
+    ]
+
+    for playlist in playlists:
+        if not len(playlist.rows) and playlist.name not in synced_before:
+            continue
+        track_ids, _ = table.select(playlist.rows)
+
+        # Sync Spotify playlist
+        playlist_sync.sync(playlist.name, track_ids, description=playlist.description)
+
+        # Create M3U playlist
+        create_m3u_playlist(playlist.name, table, playlist.rows, output_dir)
+
+
 def create_playlists(add_to_liked_songs=True):
     """
     Create playlists and optionally add songs to liked songs or a separate playlist.
+    Playlists that already exist on Spotify are updated instead of recreated.
 
     Args:
         add_to_liked_songs (bool): If True, adds songs to liked songs. If False, creates an "All Songs" playlist.
     """
+    # Playlists are not cached by CachedSpotify, PlaylistSync keeps their state
     sp = spotipy.Spotify(
         auth_manager=SpotifyOAuth(
             scope="playlist-read-private playlist-modify-private playlist-modify-public user-library-modify",
@@ -81,144 +170,33 @@ def create_playlists(add_to_liked_songs=True):
         )
     )
 
-    user_id = sp.current_user()["id"]
-    bpm_groups = {110: [], 120: [], 130: [], 140: [], 150: [], 160: []}
-    bpm_groups_files = {110: [], 120: [], 130: [], 140: [], 150: [], 160: []}
-    decade_groups = {}
-    decade_groups_files = {}
-    folder_groups = {}
-    folder_groups_files = {}
-    all_track_ids = set()
+    playlist_sync = PlaylistSync(sp, sp.current_user()["id"])
 
     # Scan music directory
-    music_dir = Path("music")
-    for file_path in music_dir.rglob("*.mp3"):
-        try:
-            audio_easy = EasyID3(file_path)
-            audio_id3 = ID3(file_path)
-
-            # Get Spotify track ID
-            spotify_url = audio_easy.get("website", [""])[0]
-            track_id = extract_spotify_track_id(spotify_url)
-            if not track_id:
-                continue
-
-            all_track_ids.add(track_id)
-
-            # Group by folder name
-            folder_name = file_path.parent.name
-            if folder_name != "music":  # Skip the root music directory
-                folder_groups.setdefault(folder_name, []).append(track_id)
-                folder_groups_files.setdefault(folder_name, []).append(file_path)
-
-            # Process BPM
-            if audio_easy.get("bpm"):
-                bpm = float(audio_easy["bpm"][0])
-                for center_bpm in bpm_groups:
-                    if center_bpm - 5 <= bpm <= center_bpm + 5:
-                        bpm_groups[center_bpm].append(track_id)
-                        bpm_groups_files[center_bpm].append(file_path)
-                        break
-
-            # Process year
-            year = get_year_from_id3(audio_id3, file_path)
-            if year:
-                decade = (year // 10) * 10
-                decade_groups.setdefault(decade, []).append(track_id)
-                decade_groups_files.setdefault(decade, []).append(file_path)
-
-        except Exception as e:
-            print(f"Error processing {file_path}: {str(e)}")
-
-    # Create BPM-based playlists
-    for bpm, track_ids in bpm_groups.items():
-        if not track_ids:
-            continue
+    index = LibraryIndex()
+    records = index.scan("music")
+    index.close()
 
-        playlist_name = f"Workout {bpm} BPM"
+    for record in records:
+        if record.error:
+            print(f"Error processing {record.path}: {record.error}")
+    table = TrackTable(records)
 
-        # Create Spotify playlist
-        playlist = sp.user_playlist_create(
-            user_id,
-            playlist_name,
-            public=True,
-            description=get_activity_description(bpm),
-        )
-
-        for i in range(0, len(track_ids), 100):
-            sp.playlist_add_items(playlist["id"], track_ids[i : i + 100])
-        print(f"Created Spotify playlist: {playlist_name} with {len(track_ids)} tracks")
-
-        # Create M3U playlist
-        create_m3u_playlist(playlist_name, bpm_groups_files[bpm])
-
-    # Create decade-based playlists
-    for decade, track_ids in sorted(decade_groups.items()):
-        if not track_ids:
-            continue
-
-        playlist_name = f"Music from the {decade}s"
-
-        # Create Spotify playlist
-        playlist = sp.user_playlist_create(
-            user_id,
-            playlist_name,
-            public=True,
-            description=f"Collection of tracks from the {decade}s",
-        )
-
-        for i in range(0, len(track_ids), 100):
-            sp.playlist_add_items(playlist["id"], track_ids[i : i + 100])
-        print(f"Created Spotify playlist: {playlist_name} with {len(track_ids)} tracks")
-
-        # Create M3U playlist
-        create_m3u_playlist(playlist_name, decade_groups_files[decade])
-
-    # Create folder-based playlists
-    for folder_name, track_ids in sorted(folder_groups.items()):
-        if not track_ids:
-            continue
-
-        # Create Spotify playlist
-        playlist = sp.user_playlist_create(
-            user_id,
-            folder_name,
-            public=True,
-            description=f"Music from the {folder_name} folder",
-        )
-
-        for i in range(0, len(track_ids), 100):
-            sp.playlist_add_items(playlist["id"], track_ids[i : i + 100])
-        print(f"Created Spotify playlist: {folder_name} with {len(track_ids)} tracks")
-
-        # Create M3U playlist
-        create_m3u_playlist(folder_name, folder_groups_files[folder_name])
+    sync_rule_playlists(playlist_sync, table)
 
     # Handle all tracks
-    track_list = list(all_track_ids)
+    track_list = list(dict.fromkeys(table.spotify_ids))
     if add_to_liked_songs:
         # Add all tracks to user's library
-        for i in range(0, len(track_list), 50):
-            sp.current_user_saved_tracks_add(tracks=track_list[i : i + 50])
-        print(f"Added {len(all_track_ids)} tracks to your Spotify library")
+        playlist_sync.save_tracks(track_list)
     else:
-        # Create an "All Songs" playlist
-        all_songs_playlist = sp.user_playlist_create(
-            user_id,
-            "All Songs",
-            public=True,
-            description="Collection of all imported tracks",
+        # Sync an "All Songs" playlist
+        playlist_sync.sync(
+            ALL_SONGS, track_list, description="Collection of all imported tracks"
         )
 
-        for i in range(0, len(track_list), 100):
-            sp.playlist_add_items(all_songs_playlist["id"], track_list[i : i + 100])
-        print(f"Created 'All Songs' playlist with {len(all_track_ids)} tracks")
-
         # Create M3U playlist for all songs
-        create_m3u_playlist(
-            "All Songs",
-            [path for paths in folder_groups_files.values() for path in paths],
-        )
+        create_m3u_playlist(ALL_SONGS, table, np.flatnonzero(table.folders != "music"))
 
 
 if __name__ == "__main__":
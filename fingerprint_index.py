@@ -0,0 +1,323 @@
+import sqlite3
+import struct
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import repeat
+from pathlib import Path
+
+import librosa
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from tqdm import tqdm
+
+from tag_scanner import UnsupportedFile, audio_digest
+
+FINGERPRINT_INDEX_PATH = Path("fingerprints.db")
+
+SAMPLE_RATE = 11025
+# Seconds of audio fingerprinted from the start of each file
+FINGERPRINT_SECONDS = 60
+FFT_SIZE = 1024
+# About 23 ms per frame
+HOP_SIZE = 256
+# Only the first 512 frequency bins are used, so a bin fits in 9 bits
+FREQUENCY_BINS = 512
+# A peak is the maximum of this many frames and frequency bins around it
+PEAK_NEIGHBOURHOOD = (15, 15)
+# Only the strongest peaks are kept
+PEAKS_PER_SECOND = 8
+# Number of following peaks every peak is paired with
+FAN_OUT = 4
+# Maximum distance of two paired peaks in frames, must fit in 6 bits
+MAX_FRAME_DELTA = 63
+
+# A match needs this many landmarks at the same time offset
+MIN_MATCHES = 20
+# and at least this share of the landmarks of the query
+MIN_MATCH_RATIO = 0.05
+
+
+def _max_filter(values: np.ndarray, size: tuple) -> np.ndarray:
+    """Maximum of the size[0] x size[1] neighbourhood of every element."""
+    for axis, width in enumerate(size):
+        padding = [(0, 0), (0, 0)]
+        padding[axis] = (width // 2, width // 2)
+        padded = np.pad(values, padding, constant_values=-np.inf)
+        values = sliding_window_view(padded, width, axis=axis).max(axis=-1)
+    return values
+
+
+def fingerprint_audio(samples: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the landmark hashes of mono audio sampled at SAMPLE_RATE.
+
+    The strongest local peaks of the spectrogram are paired with the next
+    FAN_OUT peaks. Each pair is hashed from the frequencies of both peaks and
+    their distance in time, which survive re-encoding and volume changes.
+    Returns the hashes and the frame of the first peak of every pair.
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    if len(samples) < FFT_SIZE:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    frames = sliding_window_view(samples, FFT_SIZE)[::HOP_SIZE]
+    window = np.hanning(FFT_SIZE).astype(np.float32)
+    spectrum = np.abs(np.fft.rfft(frames * window, axis=1))[:, :FREQUENCY_BINS]
+    spectrum = np.log(spectrum + 1e-6)
+
+    is_peak = (spectrum == _max_filter(spectrum, PEAK_NEIGHBOURHOOD)) & (
+        spectrum > spectrum.mean()
+    )
+    # Peaks are in order of time
+    times, bins = np.nonzero(is_peak)
+
+    limit = max(1, int(PEAKS_PER_SECOND * len(samples) / SAMPLE_RATE))
+    if len(times) > limit:
+        strongest = np.sort(np.argsort(spectrum[times, bins])[-limit:])
+        times, bins = times[strongest], bins[strongest]
+
+    hashes = []
+    offsets = []
+    for distance in range(1, FAN_OUT + 1):
+        delta = times[distance:] - times[:-distance]
+        valid = (delta > 0) & (delta <= MAX_FRAME_DELTA)
+        hashes.append(
+            bins[:-distance][valid] << 15 | bins[distance:][valid] << 6 | delta[valid]
+        )
+        offsets.append(times[:-distance][valid])
+    return (
+        np.concatenate(hashes).astype(np.int64),
+        np.concatenate(offsets).astype(np.int64),
+    )
+
+
+def fingerprint_file(file_path) -> tuple[np.ndarray, np.ndarray]:
+    """Compute the landmark hashes of the start of an audio file."""
+    samples, _ = librosa.load(
+        file_path, sr=SAMPLE_RATE, mono=True, duration=FINGERPRINT_SECONDS
+    )
+    return fingerprint_audio(samples)
+
+
+def _audio_digest(file_path):
+    try:
+        return audio_digest(file_path)
+    except (OSError, UnsupportedFile, struct.error, IndexError, ValueError):
+        return None
+
+
+class FingerprintIndex:
+    """
+    On-disk inverted index from landmark hashes to the files and times they
+    occur at.
+
+    Looking up a file only reads the entries of its own hashes, so finding the
+    files that sound the same does not compare it with every other file. Files
+    are only fingerprinted again when their audio changed, not when only their
+    tags were rewritten.
+    """
+
+    def __init__(self, index_path: Path = FINGERPRINT_INDEX_PATH):
+        self.connection = sqlite3.connect(index_path)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                audio_digest TEXT,
+                landmarks INTEGER NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS landmarks (
+                hash INTEGER NOT NULL,
+                file INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                PRIMARY KEY (hash, file, offset)
+            ) WITHOUT ROWID
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS landmarks_file ON landmarks (file)"
+        )
+        self.connection.execute(
+            "CREATE TEMP TABLE query (hash INTEGER NOT NULL, offset INTEGER NOT NULL)"
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def _store(self, record, digest, hashes, offsets):
+        # Keep the ID of a file that is fingerprinted again
+        file_id = self._file_id(record.path)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files "
+            "(id, path, size, mtime_ns, audio_digest, landmarks) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (file_id, record.path, record.size, record.mtime_ns, digest, len(hashes)),
+        )
+        if file_id is None:
+            file_id = self._file_id(record.path)
+        self.connection.execute("DELETE FROM landmarks WHERE file = ?", (file_id,))
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO landmarks (hash, file, offset) VALUES (?, ?, ?)",
+            zip(hashes.tolist(), repeat(file_id), offsets.tolist()),
+        )
+        self.connection.commit()
+
+    def update(self, records: list, workers: int = None):
+        """
+        Fingerprint the files of the library records that are new or whose
+        audio changed, in a process pool. Files that no longer exist are
+        dropped from the index.
+        """
+        indexed = {
+            path: (size, mtime_ns, digest)
+            for path, size, mtime_ns, digest in self.connection.execute(
+                "SELECT path, size, mtime_ns, audio_digest FROM files"
+            )
+        }
+
+        changed = []
+        for record in records:
+            if record.error or record.size is None:
+                continue
+            row = indexed.get(record.path)
+            if row and row[:2] == (record.size, record.mtime_ns):
+                continue
+            digest = _audio_digest(record.path)
+            if row and digest and row[2] == digest:
+                # Only the tags changed
+                self.connection.execute(
+                    "UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?",
+                    (record.size, record.mtime_ns, record.path),
+                )
+                continue
+            changed.append((record, digest))
+        self.connection.commit()
+
+        if changed:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(fingerprint_file, record.path): (record, digest)
+                    for record, digest in changed
+                }
+                for future in tqdm(
+                    as_completed(futures),
+                    total=len(futures),
+                    desc="Fingerprinting",
+                    unit="file",
+                ):
+                    record, digest = futures[future]
+                    try:
+                        hashes, offsets = future.result()
+                    except Exception as e:
+                        print(f"Error fingerprinting {record.path}: {e}")
+                        continue
+                    self._store(record, digest, hashes, offsets)
+
+        seen = {record.path for record in records}
+        stale = [
+            (file_id,)
+            for file_id, path in self.connection.execute("SELECT id, path FROM files")
+            if path not in seen and not Path(path).exists()
+        ]
+        self.connection.executemany("DELETE FROM landmarks WHERE file = ?", stale)
+        self.connection.executemany("DELETE FROM files WHERE id = ?", stale)
+        self.connection.commit()
+
+    def _file_id(self, file_path):
+        row = self.connection.execute(
+            "SELECT id FROM files WHERE path = ?", (str(file_path),)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def _path(self, file_id: int) -> str:
+        return self.connection.execute(
+            "SELECT path FROM files WHERE id = ?", (file_id,)
+        ).fetchone()[0]
+
+    def match(self, hashes: np.ndarray, offsets: np.ndarray, exclude=None) -> list:
+        """
+        Find the indexed files that contain the fingerprinted audio.
+
+        A file matches if enough of its landmarks occur at the same time offset
+        relative to the query. Returns (path, number of matching landmarks)
+        pairs, best match first.
+        """
+        self.connection.execute("DELETE FROM query")
+        self.connection.executemany(
+            "INSERT INTO query (hash, offset) VALUES (?, ?)",
+            zip(hashes.tolist(), offsets.tolist()),
+        )
+        rows = self.connection.execute(
+            "SELECT landmarks.file, landmarks.offset - query.offset FROM query "
+            "JOIN landmarks ON landmarks.hash = query.hash "
+            "WHERE landmarks.file IS NOT ?",
+            (exclude,),
+        ).fetchall()
+        if not rows:
+            return []
+
+        # Count the landmarks of every file and time offset in one array
+        rows = np.array(rows, dtype=np.int64)
+        keys = rows[:, 0] << 32 | rows[:, 1] + 2**31
+        keys, counts = np.unique(keys, return_counts=True)
+        files = keys >> 32
+        # Keep the best offset of every file
+        order = np.lexsort((counts, files))
+        files, counts = files[order], counts[order]
+        last = np.append(files[1:] != files[:-1], True)
+        files, counts = files[last], counts[last]
+
+        threshold = max(MIN_MATCHES, MIN_MATCH_RATIO * len(hashes))
+        best = np.argsort(-counts, kind="stable")
+        return [
+            (self._path(int(files[i])), int(counts[i]))
+            for i in best
+            if counts[i] >= threshold
+        ]
+
+    def match_file(self, file_path) -> list:
+        """
+        Find the other indexed files that sound like an indexed file.
+        """
+        file_id = self._file_id(file_path)
+        if file_id is None:
+            return []
+        landmarks = np.array(
+            self.connection.execute(
+                "SELECT hash, offset FROM landmarks WHERE file = ?", (file_id,)
+            ).fetchall(),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        return self.match(landmarks[:, 0], landmarks[:, 1], exclude=file_id)
+
+    def duplicates(self) -> list:
+        """
+        Group the indexed files that sound the same. Returns lists of paths,
+        each with at least two files.
+        """
+        paths = [path for (path,) in self.connection.execute("SELECT path FROM files")]
+        # Union-find over the matches of every file
+        parents = {path: path for path in paths}
+
+        def find(path):
+            while parents[path] != path:
+                parents[path] = parents[parents[path]]
+                path = parents[path]
+            return path
+
+        for path in paths:
+            for other, _ in self.match_file(path):
+                parents[find(other)] = find(path)
+
+        groups = {}
+        for path in paths:
+            groups.setdefault(find(path), []).append(path)
+        return [sorted(group) for group in groups.values() if len(group) > 1]
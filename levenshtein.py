@@ -1,19 +1,128 @@
-def levenshtein_distance_ignore_word_order(str1, str2):
-    # Split the strings into words
-    words1 = str1.split()
-    words2 = str2.split()
+import numpy as np
 
-    # Sort the words
-    sorted_words1 = "".join(sorted(words1))
-    sorted_words2 = "".join(sorted(words2))
+# Number of candidates compared at once by levenshtein_distances, bounds the
+# memory used for the DP matrix
+CHUNK_SIZE = 65536
 
-    # Calculate Levenshtein distance
-    return levenshtein_distance(sorted_words1, sorted_words2)
 
+def _sort_words(string):
+    # Split the string into words, sort them and join them without spaces
+    return "".join(sorted(string.split()))
 
-def levenshtein_distance(s1, s2):
+
+def levenshtein_distance_ignore_word_order(str1, str2, max_distance=None):
+    # Calculate Levenshtein distance of the sorted words
+    return levenshtein_distance(_sort_words(str1), _sort_words(str2), max_distance)
+
+
+def levenshtein_distances_ignore_word_order(query, candidates, max_distance=None):
+    """
+    Calculate the word order independent Levenshtein distance between a query
+    and many candidates at once. See levenshtein_distances.
+    """
+    return levenshtein_distances(
+        _sort_words(query),
+        [_sort_words(candidate) for candidate in candidates],
+        max_distance,
+    )
+
+
+def _encode(string):
+    return np.frombuffer(string.encode("utf-32-le"), dtype="<u4").astype(np.int64)
+
+
+def levenshtein_distances(query, candidates, max_distance=None):
+    """
+    Calculate the Levenshtein distance between a query and many candidates.
+
+    The DP rows of all candidates are computed together with NumPy, one
+    candidate character at a time.
+
+    If max_distance is given, distances above it are returned as
+    max_distance + 1, like levenshtein_distance does.
+
+    Returns:
+        (distances, best_index) where distances is an array with the distance
+        to each candidate and best_index the index of the first closest
+        candidate, or -1 if there are no candidates.
+    """
+    lengths = np.fromiter((len(c) for c in candidates), dtype=np.int64)
+    distances = np.abs(lengths - len(query))
+
+    # Candidates whose length differs too much can not be within the bound
+    if max_distance is not None:
+        todo = np.flatnonzero(distances <= max_distance)
+    else:
+        todo = np.arange(len(candidates))
+
+    query_codes = _encode(query)
+    for chunk_start in range(0, len(todo), CHUNK_SIZE):
+        chunk = todo[chunk_start : chunk_start + CHUNK_SIZE]
+        distances[chunk] = _levenshtein_distances_chunk(
+            query_codes, [candidates[i] for i in chunk], lengths[chunk]
+        )
+
+    if max_distance is not None:
+        np.minimum(distances, max_distance + 1, out=distances)
+
+    best_index = int(np.argmin(distances)) if len(distances) else -1
+    return distances, best_index
+
+
+def _levenshtein_distances_chunk(query_codes, candidates, lengths):
+    n = len(query_codes)
+
+    # Sort the candidates by length, longest first, so the candidates that are
+    # still being processed always form the first rows of the matrix
+    order = np.argsort(-lengths, kind="stable")
+    sorted_lengths = lengths[order]
+    longest = int(sorted_lengths[0]) if len(order) else 0
+
+    # Candidate characters padded with -1, which never matches a character
+    codes = np.full((len(candidates), longest), -1, dtype=np.int64)
+    for row, index in enumerate(order):
+        codes[row, : sorted_lengths[row]] = _encode(candidates[index])
+
+    # rows[k, i] is the distance between the processed prefix of candidate k
+    # and the first i characters of the query
+    columns = np.arange(n + 1)
+    rows = np.tile(columns, (len(candidates), 1))
+
+    for j in range(longest):
+        # Candidates shorter than j + 1 keep their final row
+        active = int(np.count_nonzero(sorted_lengths > j))
+        previous = rows[:active]
+        mismatch = query_codes[None, :] != codes[:active, j, None]
+
+        step = np.empty_like(previous)
+        step[:, 0] = j + 1
+        np.minimum(previous[:, 1:] + 1, previous[:, :-1] + mismatch, out=step[:, 1:])
+
+        # Insertions chain along the row: new[i] = min over t <= i of
+        # step[t] + (i - t), which is a running minimum of step - i
+        step -= columns
+        np.minimum.accumulate(step, axis=1, out=step)
+        step += columns
+
+        rows[:active] = step
+
+    distances = np.empty(len(candidates), dtype=np.int64)
+    distances[order] = rows[:, n]
+    return distances
+
+
+def levenshtein_distance(s1, s2, max_distance=None):
+    """
+    Calculate the Levenshtein distance between two strings.
+
+    If max_distance is given, the calculation stops as soon as the distance is
+    known to exceed it and max_distance + 1 is returned instead.
+    """
     if len(s1) < len(s2):
-        return levenshtein_distance(s2, s1)
+        return levenshtein_distance(s2, s1, max_distance)
+
+    if max_distance is not None:
+        return _bounded_levenshtein_distance(s1, s2, max_distance)
 
     # len(s1) >= len(s2)
     previous_row = range(len(s2) + 1)
@@ -27,3 +136,62 @@ def levenshtein_distance(s1, s2):
         previous_row = current_row
 
     return previous_row[-1]
+
+
+def _bounded_levenshtein_distance(s1, s2, max_distance):
+    # len(s1) >= len(s2), the distance is at least the difference in length
+    exceeded = max_distance + 1
+    if len(s1) - len(s2) > max_distance:
+        return exceeded
+
+    # Common prefixes and suffixes do not change the distance
+    start = 0
+    while start < len(s2) and s1[start] == s2[start]:
+        start += 1
+    end1, end2 = len(s1), len(s2)
+    while end2 > start and s1[end1 - 1] == s2[end2 - 1]:
+        end1 -= 1
+        end2 -= 1
+    s1 = s1[start:end1]
+    s2 = s2[start:end2]
+
+    n, m = len(s1), len(s2)
+    if m == 0:
+        return n if n <= max_distance else exceeded
+
+    # Only cells within max_distance of the diagonal can hold a distance
+    # within the bound, all other cells are treated as exceeded.
+    previous_row = [j if j <= max_distance else exceeded for j in range(m + 1)]
+    current_row = [exceeded] * (m + 1)
+
+    for i in range(1, n + 1):
+        c1 = s1[i - 1]
+        low = max(1, i - max_distance)
+        high = min(m, i + max_distance)
+
+        current_row[0] = i if i <= max_distance else exceeded
+        if low > 1:
+            current_row[low - 1] = exceeded
+        row_min = current_row[0]
+
+        for j in range(low, high + 1):
+            distance = previous_row[j - 1] + (c1 != s2[j - 1])
+            if previous_row[j] + 1 < distance:
+                distance = previous_row[j] + 1
+            if current_row[j - 1] + 1 < distance:
+                distance = current_row[j - 1] + 1
+            if distance > exceeded:
+                distance = exceeded
+            current_row[j] = distance
+            if distance < row_min:
+                row_min = distance
+
+        # Distances never decrease from one row to the next
+        if row_min > max_distance:
+            return exceeded
+
+        if high < m:
+            current_row[high + 1] = exceeded
+        previous_row, current_row = current_row, previous_row
+
+    return previous_row[m]
@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+from tqdm import tqdm
+
+from tag_scanner import read_track_info, scan_files
+from track_records import SpotifyTrack, TrackRecord
+
+INDEX_PATH = Path("library_index.db")
+
+# Bump whenever the columns or the extraction logic change, the index is
+# rebuilt from scratch on the next run.
+SCHEMA_VERSION = 4
+
+COLUMNS = TrackRecord._fields
+
+
+class LibraryIndex:
+    """
+    On-disk index of the tags of every file in the library.
+
+    Entries are keyed by path and only re-read from the file when its size or
+    modification time changed since it was indexed. The index can be shared by
+    multiple threads.
+    """
+
+    def __init__(self, index_path: Path = INDEX_PATH):
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(index_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS tracks")
+            self.connection.execute("DROP TABLE IF EXISTS processed")
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tracks (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                website TEXT,
+                spotify_id TEXT,
+                bpm REAL,
+                year INTEGER,
+                title TEXT,
+                artist TEXT,
+                duration REAL,
+                has_cover INTEGER NOT NULL,
+                cover_hash TEXT,
+                error TEXT
+            )
+            """
+        )
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS processed (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                track_id TEXT,
+                snapshot TEXT,
+                status TEXT NOT NULL
+            )
+            """
+        )
+        self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def _cached(self, path: str, stat: os.stat_result):
+        row = self.connection.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM tracks WHERE path = ?", (path,)
+        ).fetchone()
+
+        if row and row["size"] == stat.st_size and row["mtime_ns"] == stat.st_mtime_ns:
+            return TrackRecord(*row)._replace(has_cover=bool(row["has_cover"]))
+        return None
+
+    def _store(self, path: str, stat: os.stat_result, record: TrackRecord):
+        # The file is re-read on the next run if it changed while being read
+        record = record._replace(
+            path=path, size=stat.st_size, mtime_ns=stat.st_mtime_ns
+        )
+        self.connection.execute(
+            f"INSERT OR REPLACE INTO tracks ({', '.join(COLUMNS)}) "
+            f"VALUES ({', '.join('?' for _ in COLUMNS)})",
+            record,
+        )
+        return record
+
+    def _lookup(self, path: str, stat: os.stat_result) -> TrackRecord:
+        record = self._cached(path, stat)
+        if record is None:
+            record = self._store(path, stat, read_track_info(path))
+        return record
+
+    def get(self, file_path) -> TrackRecord:
+        """
+        Get the indexed tags of a single file, re-reading it if it changed.
+        """
+        path = os.path.normpath(file_path)
+        stat = os.stat(path)
+        with self.lock:
+            record = self._lookup(path, stat)
+            self.connection.commit()
+        return record
+
+    def get_many(self, file_paths) -> list[TrackRecord]:
+        """
+        Get the indexed tags of many files at once. Files that changed are read
+        concurrently and stored in a single commit. Files that can not be
+        accessed are left out.
+        """
+        stats = {}
+        for file_path in file_paths:
+            path = os.path.normpath(file_path)
+            try:
+                stats[path] = os.stat(path)
+            except OSError as e:
+                print(f"Error processing {path}: {e}")
+
+        with self.lock:
+            records = {}
+            for path, stat in stats.items():
+                record = self._cached(path, stat)
+                if record is not None:
+                    records[path] = record
+
+        # Other threads can use the index while the changed files are read
+        changed = [path for path in stats if path not in records]
+        read = list(scan_files(changed))
+        with self.lock:
+            for path, record in read:
+                records[path] = self._store(path, stats[path], record)
+            self.connection.commit()
+
+        return [records[path] for path in stats]
+
+    def scan(self, music_dir="music", desc="Scanning library") -> list[TrackRecord]:
+        """
+        Get the indexed tags of all MP3 files in a directory.
+
+        Files that changed are read concurrently. Files that were removed from
+        the directory are dropped from the index.
+        """
+        paths = []
+        for root, _, files in os.walk(music_dir):
+            for file in files:
+                if file.lower().endswith(".mp3"):
+                    paths.append(os.path.normpath(os.path.join(root, file)))
+
+        records = {}
+        stats = {}
+        with self.lock:
+            for path in paths:
+                try:
+                    stats[path] = os.stat(path)
+                except OSError as e:
+                    print(f"Error processing {path}: {e}")
+                    continue
+                record = self._cached(path, stats[path])
+                if record is not None:
+                    records[path] = record
+
+            changed = [path for path in stats if path not in records]
+            with tqdm(total=len(stats), desc=desc, unit="file") as progress:
+                progress.update(len(records))
+                for path, record in scan_files(changed):
+                    records[path] = self._store(path, stats[path], record)
+                    progress.update()
+
+            # Forget files that no longer exist below the scanned directory
+            prefix = os.path.join(os.path.normpath(music_dir), "")
+            seen = set(paths)
+            stale = [
+                (row["path"],)
+                for row in self.connection.execute(
+                    "SELECT path FROM tracks WHERE substr(path, 1, ?) = ?",
+                    (len(prefix), prefix),
+                )
+                if row["path"] not in seen
+            ]
+            self.connection.executemany("DELETE FROM tracks WHERE path = ?", stale)
+            self.connection.executemany("DELETE FROM processed WHERE path = ?", stale)
+            self.connection.commit()
+
+        return [records[path] for path in stats]
+
+    def _processed_row(self, path: str, stat: os.stat_result):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT * FROM processed WHERE path = ?", (path,)
+            ).fetchone()
+        if row and row["size"] == stat.st_size and row["mtime_ns"] == stat.st_mtime_ns:
+            return row
+        return None
+
+    def is_processed(self, file_path) -> bool:
+        """
+        Check if a file was fully processed and has not changed since.
+        """
+        path = os.path.normpath(file_path)
+        row = self._processed_row(path, os.stat(path))
+        return row is not None and row["status"] == "ok"
+
+    def has_snapshot(self, file_path, track: SpotifyTrack) -> bool:
+        """
+        Check if an unchanged file was already processed with this exact track.
+        """
+        path = os.path.normpath(file_path)
+        row = self._processed_row(path, os.stat(path))
+        return (
+            row is not None
+            and row["status"] == "ok"
+            and row["track_id"] == track.id
+            and row["snapshot"] == track_snapshot(track)
+        )
+
+    def mark_processed(self, file_path, track: SpotifyTrack):
+        """
+        Record that a file was fully processed with the given Spotify track.
+        """
+        self._mark(file_path, track.id, track_snapshot(track), "ok")
+
+    def mark_failed(self, file_path, track_id=None):
+        """
+        Record that processing a file failed, so it is retried on the next run.
+        """
+        self._mark(file_path, track_id, None, "failed")
+
+    def _mark(self, file_path, track_id, snapshot, status):
+        path = os.path.normpath(file_path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO processed "
+                "(path, size, mtime_ns, track_id, snapshot, status) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, track_id, snapshot, status),
+            )
+            self.connection.commit()
+
+
+def track_snapshot(track: SpotifyTrack) -> str:
+    """
+    Hash of the Spotify track data used to detect changes between runs.
+    """
+    data = json.dumps(track, ensure_ascii=False)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
@@ -1,91 +1,56 @@
+import argparse
 import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import Path
 
-import mutagen
-import requests
 import spotipy
 from dotenv import load_dotenv
-from mutagen.easyid3 import EasyID3
-from mutagen.id3 import APIC, ID3, TORY, TYER
-from pydub import AudioSegment
 from spotipy.oauth2 import SpotifyClientCredentials
-from tqdm import tqdm
 
-from bpm import get_bpm
-from levenshtein import levenshtein_distance_ignore_word_order
-from parse_year import parse_year
-from safe_json import load_dict_from_json, save_dict_to_json
+from bpm import BPM_TIMEOUT, BpmPool
+from convert import DEFAULT_BITRATE, DEFAULT_CODEC, convert_library, convert_to_mp3
+from cover_art import CoverArtStore
+from levenshtein import levenshtein_distances_ignore_word_order
+from library_index import LibraryIndex
+from match_cache import MatchCache
+from pipeline import Stage, run_pipeline
 from sort_tracks import sort_tracks
-from spotify_track_id import extract_spotify_track_id
+from spotify_cache import (
+    DEFAULT_MAX_ENTRIES,
+    DEFAULT_TTL,
+    CachedSpotify,
+    SpotifyCacheMiss,
+)
+from spotify_search import (
+    SEARCH_RATE,
+    SEARCH_WORKERS,
+    TokenBucket,
+    search_track,
+    spotify_session,
+)
 from string_cleaning import (
     clean_string_for_filename,
     normalize_string,
     remove_song_version_info,
 )
+from tag_writer import write_track_tags
+from track_records import SpotifyTrack, TrackRecord
 
 load_dotenv()
 
 LEVENSHTEIN_DISTANCE_THRESHOLD = 2
+# Number of files whose tags are looked up in the index at once
+SCAN_BATCH_SIZE = 32
 
 
-def update_metadata(file: Path, track: dict):
-    cover_image_url = track["album"]["images"][0]["url"]
-
-    # Download the cover art if it doesn't exist
-    cover_image_path = Path(f"cover_art/{track['album']['id']}.jpg")
-    if not cover_image_path.exists():
-        with open(cover_image_path, "wb") as f:
-            f.write(requests.get(cover_image_url).content)
-
-    # Load the file and check if it has a header
-    try:
-        audio = EasyID3(file)
-    except mutagen.id3.ID3NoHeaderError:
-        audio = mutagen.File(file, easy=True)
-        audio.add_tags()
-
-    title = track["name"]
-    artist = track["artists"][0]["name"]
-
-    audio = EasyID3(file)
-    audio["title"] = title
-    audio["artist"] = artist
-    audio["album"] = track["album"]["name"]
-    audio["website"] = track["external_urls"]["spotify"]
-
-    if "isrc" in track["external_ids"] and track["external_ids"]["isrc"]:
-        audio["isrc"] = track["external_ids"]["isrc"]
-
-    audio["tracknumber"] = str(track["track_number"])
-    audio["discnumber"] = str(track["disc_number"])
-
-    if "bpm" not in audio:
-        try:
-            audio["bpm"] = get_bpm(file)
-        except:
-            print(f"Failed to get BPM for {file.name}")
-            pass
-
-    audio.save(v2_version=3)
-
-    audio = ID3(file)
-    year = parse_year(track["album"]["release_date"])
-
-    audio["TORY"] = TORY(encoding=3, text=[year])
-    audio["TYER"] = TYER(encoding=3, text=[year])
-
-    with open(cover_image_path, "rb") as albumart:
-        audio["APIC"] = APIC(
-            encoding=3,
-            mime="image/jpeg",
-            type=3,
-            desc="Cover",
-            data=albumart.read(),
-        )
-    audio.save(v2_version=3)
+def update_metadata(
+    file: Path, track: SpotifyTrack, cover_image_path: Path, bpm: int = None
+):
+    write_track_tags(file, track, cover_image_path, bpm)
 
     # New filename
-    new_filename = f"{artist} - {title}"
+    new_filename = f"{track.artist} - {track.name}"
 
     clean_name = clean_string_for_filename(remove_song_version_info(new_filename))
 
@@ -97,146 +62,439 @@ def update_metadata(file: Path, track: dict):
     return file.rename(new_file)
 
 
-distances_savefile_path = Path("distances.json")
-distance_dict = load_dict_from_json(distances_savefile_path)
-
-
-def convert_to_mp3(file: Path) -> Path:
+def match_search_results(
+    file: Path, normalized_name: str, results: dict, match_cache: MatchCache
+):
     """
-    Converts a file to mp3 and deletes the original file.
+    Find the track matching a file in its Spotify search results and record the
+    match in the cache. Returns the track ID or None if no track matches.
     """
-    mp3_file = file.with_suffix(".mp3")
+    if not results["tracks"]["items"]:
+        print(f"Skipping {file.name} because no results were found")
+        return None
 
-    audio = AudioSegment.from_file(file, format=file.suffix[1:])
-    audio.export(mp3_file, format="mp3")
-    print(f"Converted: {file.name} -> {mp3_file.name}")
+    results = sort_tracks(results["tracks"]["items"])
 
-    file.unlink()
-    print(f"Deleted: {file}")
+    correct_names = [
+        normalize_string(
+            track["artists"][0]["name"]
+            + " - "
+            + remove_song_version_info(track["name"])
+        )
+        for track in results
+    ]
+
+    # Distances above the threshold are only reported as threshold + 1
+    distances, best_index = levenshtein_distances_ignore_word_order(
+        normalized_name,
+        correct_names,
+        max_distance=LEVENSHTEIN_DISTANCE_THRESHOLD,
+    )
+    best_distance = int(distances[best_index])
+
+    cached_match = match_cache.get(normalized_name)
+    if not cached_match or best_distance < cached_match["distance"]:
+        print(f"Correct name:    {correct_names[best_index]}")
+        print(f"Normalized name: {normalized_name}")
+        print(f"Distance:        {best_distance}\n")
 
-    return mp3_file
+    # Use the first result in sort order that is within the threshold
+    matched_tracks = [
+        track
+        for track, distance in zip(results, distances)
+        if distance <= LEVENSHTEIN_DISTANCE_THRESHOLD
+    ]
+    match_id = matched_tracks[0]["id"] if matched_tracks else None
+    match_cache.record(normalized_name, best_distance, match_id)
 
+    if not match_id:
+        print(f"Skipping {file.name} because no matches were found")
+    return match_id
 
-def update_metadata_batch(files_and_tracks: list[tuple[Path, dict]]):
+
+def needs_update(file: Path, track: SpotifyTrack, index: LibraryIndex) -> bool:
     """
-    Update metadata for multiple files in batch
+    Check if a file was not yet processed with exactly this track.
     """
-    for file, track in tqdm(
-        files_and_tracks, desc="Processing files", unit="file", leave=False
-    ):
-        try:
-            update_metadata(file, track)
-        except Exception as e:
-            print(f"Failed to update metadata for {file.name}: {e}")
+    try:
+        return track is None or not index.has_snapshot(file, track)
+    except OSError:
+        return True
 
 
-if __name__ == "__main__":
-    spotify = spotipy.Spotify(
-        auth_manager=SpotifyClientCredentials(
-            client_id=os.getenv("SPOTIFY_CLIENT_ID"),
-            client_secret=os.getenv("SPOTIFY_CLIENT_SECRET"),
-        ),
-    )
-
-    all_files = list(Path("music").glob("**/*.*"))
-    loaded_files = 0
-    processed_files = 0
+def needs_bpm(record: TrackRecord) -> bool:
+    return record.bpm is None
 
-    # Store files that need track info fetching
-    pending_tracks = []  # List of (file, track_id) tuples
 
-    # First pass - identify files that need processing
-    for file in tqdm(all_files, desc="Identifying files", unit="file"):
-        loaded_files += 1
+class Organizer:
+    """
+    The stages of organizing the library, run concurrently by run_pipeline.
+    Each stage takes the items of the previous stage and yields its own.
+    """
 
+    def __init__(self, args, spotify: CachedSpotify):
+        self.args = args
+        self.spotify = spotify
+        self.index = LibraryIndex()
+        # Tags of the files read by the scan stage, by normalized path
+        self.records = {}
+        # Searches in flight by normalized name, shared by files with that name
+        self.searches = {}
+        self.search_lock = threading.Lock()
+        self.match_cache = MatchCache()
+        self.rate_limiter = TokenBucket(args.search_rate)
+        self.bpm_pool = BpmPool(
+            workers=args.bpm_workers, timeout=args.bpm_timeout, fast=args.fast_bpm
+        )
+        self.convert_pool = ProcessPoolExecutor(max_workers=args.convert_workers)
+        self.covers = CoverArtStore(workers=args.download_workers)
+        self.unchanged_files = 0
+
+    def close(self):
+        self.convert_pool.shutdown()
+        self.covers.close()
+        self.bpm_pool.close()
+        self.match_cache.close()
+        self.index.close()
+
+    def record(self, file: Path) -> TrackRecord:
+        """
+        The indexed tags of a file. Files that were not read by the scan stage,
+        e.g. converted files, are read now.
+        """
+        record = self.records.get(os.path.normpath(file))
+        if record is None or record.error:
+            record = self.index.get(file)
+        return record
+
+    def stages(self) -> list:
+        cpus = os.cpu_count() or 1
+        args = self.args
+        return [
+            Stage("Scanning", self.scan, batch_size=SCAN_BATCH_SIZE),
+            Stage("Converting", self.convert, workers=args.convert_workers or cpus),
+            Stage("Identifying", self.identify),
+            Stage("Searching", self.search, workers=args.search_workers),
+            Stage("Fetching tracks", self.fetch_tracks, batch_size=50),
+            Stage(
+                "Downloading covers",
+                self.download_cover,
+                workers=args.download_workers,
+            ),
+            Stage("Detecting BPM", self.detect_bpm, workers=args.bpm_workers or cpus),
+            Stage("Writing tags", self.write_tags),
+        ]
+
+    def scan(self, files: list):
         # Skip unsupported extensions
-        if file.suffix.lower() not in [".mp3", ".flac", ".m4a"]:
-            continue
+        files = [
+            file for file in files if file.suffix.lower() in [".mp3", ".flac", ".m4a"]
+        ]
+
+        # Read the tags of the whole batch at once instead of one by one in the
+        # later stages. Other files are read once they are converted.
+        mp3_files = [file for file in files if file.suffix.lower() == ".mp3"]
+        for record in self.index.get_many(mp3_files):
+            self.records[record.path] = record
+
+        for file in files:
+            # Skip files that did not change since they were last processed
+            try:
+                if self.args.incremental and self.index.is_processed(file):
+                    self.unchanged_files += 1
+                    continue
+            except OSError as e:
+                print(f"Error processing {file}: {e}")
+                continue
+
+            yield file
 
+    def convert(self, file: Path):
         # Convert to mp3 if necessary
         if file.suffix.lower() in [".m4a", ".flac"]:
             try:
-                file = convert_to_mp3(file)
+                file = self.convert_pool.submit(
+                    convert_to_mp3, file, self.args.bitrate, self.args.codec
+                ).result()
             except Exception as e:
                 print(f"Failed to convert {file.name}: {e}")
-                continue
+                return
+
+        yield file
 
+    def identify(self, file: Path):
         # Check if file already has Spotify metadata
         try:
-            audio = EasyID3(file)
-            if "website" in audio and "spotify" in audio["website"][0]:
-                spotify_id = extract_spotify_track_id(audio["website"][0])
-                pending_tracks.append((file, spotify_id))
-                continue
-        except:
+            record = self.record(file)
+            if record.spotify_id:
+                yield file, record.spotify_id, None
+                return
+        except OSError:
             pass
 
-        # Search for track if no Spotify metadata exists
         normalized_name = normalize_string(file.stem)
 
-        if normalized_name in distance_dict:
-            distance = distance_dict[normalized_name]
+        cached_match = self.match_cache.get(normalized_name)
+        if cached_match:
+            distance = cached_match["distance"]
             if distance > LEVENSHTEIN_DISTANCE_THRESHOLD:
                 print(f"Skipping {file.name} because it has a distance of {distance}")
-                continue
-
-        results = spotify.search(q=normalized_name, type="track", market="DE")
+                return
+            if cached_match["track_id"]:
+                yield file, cached_match["track_id"], None
+                return
+
+        yield file, None, normalized_name
+
+    def _search(self, normalized_name: str) -> dict:
+        """
+        Search for a normalized name. Files with the same name that are searched
+        at the same time wait for the first search instead of sending their own.
+        """
+        with self.search_lock:
+            future = self.searches.get(normalized_name)
+            first = future is None
+            if first:
+                future = self.searches[normalized_name] = Future()
+        if not first:
+            return future.result()
 
-        if not results["tracks"]["items"]:
-            print(f"Skipping {file.name} because no results were found")
-            continue
+        try:
+            # Later files with this name find the result in the cache
+            results = self.spotify.cached_search(
+                q=normalized_name, type="track", market="DE"
+            )
+            if results is None:
+                if self.args.offline:
+                    raise SpotifyCacheMiss(f"Not cached: {normalized_name}")
+                results = search_track(self.spotify, normalized_name, self.rate_limiter)
+            future.set_result(results)
+            return results
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.search_lock:
+                del self.searches[normalized_name]
+
+    def search(self, item):
+        file, track_id, normalized_name = item
 
-        results = sort_tracks(results["tracks"]["items"])
-        matched_tracks = []
+        # Search for track if no Spotify metadata exists
+        if track_id is None:
+            try:
+                results = self._search(normalized_name)
+            except SpotifyCacheMiss:
+                print(f"Skipping {file.name} because the search is not cached")
+                return
+            except Exception as e:
+                print(f"Failed to search for {file.name}: {e}")
+                return
 
-        for track in results:
-            correct_name = normalize_string(
-                track["artists"][0]["name"]
-                + " - "
-                + remove_song_version_info(track["name"])
+            track_id = match_search_results(
+                file, normalized_name, results, self.match_cache
             )
+            if not track_id:
+                return
 
-            distance = levenshtein_distance_ignore_word_order(
-                correct_name, normalized_name
-            )
+        yield file, track_id
 
-            if (
-                normalized_name not in distance_dict
-                or distance < distance_dict[normalized_name]
-            ):
-                distance_dict[normalized_name] = distance
-                print(f"Correct name:    {correct_name}")
-                print(f"Normalized name: {normalized_name}")
-                print(f"Distance:        {distance}\n")
-
-            if distance <= LEVENSHTEIN_DISTANCE_THRESHOLD:
-                matched_tracks.append(track)
-
-        save_dict_to_json(distance_dict, distances_savefile_path)
-
-        if matched_tracks:
-            pending_tracks.append((file, matched_tracks[0]["id"]))
-        else:
-            print(f"Skipping {file.name} because no matches were found")
-
-    # Process pending tracks in batches of 50
-    for i in tqdm(
-        range(0, len(pending_tracks), 50), desc="Processing batches", unit="batch"
-    ):
-        batch = pending_tracks[i : i + 50]
+    def fetch_tracks(self, batch: list):
         track_ids = [track_id for _, track_id in batch]
-
         try:
-            print(f"Fetching {len(track_ids)} tracks")
-            print(track_ids)
-            tracks_info = spotify.tracks(track_ids, market="DE")["tracks"]
-            print(f"Fetched {len(tracks_info)} tracks")
-            files_and_tracks = [
-                (file, track_info) for (file, _), track_info in zip(batch, tracks_info)
+            tracks_info = [
+                SpotifyTrack.from_api(track) if track else None
+                for track in self.spotify.tracks(track_ids, market="DE")["tracks"]
             ]
-            update_metadata_batch(files_and_tracks)
-            processed_files += len(files_and_tracks)
         except Exception as e:
-            print(f"Failed to process batch: {e}")
+            print(f"Failed to fetch {len(track_ids)} tracks: {e}")
+            return
+
+        # Start downloading the covers of the whole batch at once
+        self.covers.prefetch(tracks_info)
+
+        for (file, track_id), track in zip(batch, tracks_info):
+            if track is None:
+                print(f"Track {track_id} of {file.name} is not available")
+                continue
+            # Skip unchanged files that were already processed with the same track
+            if needs_update(file, track, self.index):
+                yield file, track
+
+    def download_cover(self, item):
+        file, track = item
+        try:
+            if self.args.embed_cover_size:
+                cover_image_path = self.covers.get_resized(
+                    track, self.args.embed_cover_size
+                )
+            else:
+                cover_image_path = self.covers.get(track)
+        except Exception as e:
+            print(f"Failed to download cover for {file.name}: {e}")
+            self.index.mark_failed(file)
+            return
+        yield file, track, cover_image_path
+
+    def detect_bpm(self, item):
+        file, track, cover_image_path = item
+        bpm = None
+        bpm_failed = False
+        try:
+            missing_bpm = needs_bpm(self.record(file))
+        except OSError:
+            missing_bpm = False
+        if missing_bpm:
+            try:
+                bpm = self.bpm_pool.get_bpm(file)
+            except Exception as e:
+                print(f"Failed to get BPM for {file.name}: {e}")
+                bpm_failed = True
+        yield file, track, cover_image_path, bpm, bpm_failed
+
+    def write_tags(self, item):
+        file, track, cover_image_path, bpm, bpm_failed = item
+        try:
+            new_file = update_metadata(file, track, cover_image_path, bpm)
+            if bpm_failed:
+                # The other tags are written, the BPM is retried on the next run
+                self.index.mark_failed(new_file or file, track.id)
+            else:
+                self.index.mark_processed(new_file or file, track)
+        except Exception as e:
+            print(f"Failed to update metadata for {file.name}: {e}")
+            self.index.mark_failed(file)
+            return
+        yield new_file or file
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Match music files with Spotify and update their metadata."
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Skip files that were fully processed and have not changed since",
+    )
+    parser.add_argument(
+        "--convert-workers",
+        type=int,
+        default=None,
+        help="Number of files converted to MP3 at once (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--convert-first",
+        action="store_true",
+        help="Convert all files to MP3 before matching any of them",
+    )
+    parser.add_argument(
+        "--bitrate",
+        default=DEFAULT_BITRATE,
+        help="Bitrate of converted MP3 files, e.g. 320k (default: ffmpeg's default)",
+    )
+    parser.add_argument(
+        "--codec",
+        default=DEFAULT_CODEC,
+        help="Encoder of converted MP3 files, e.g. libmp3lame (default: ffmpeg's)",
+    )
+    parser.add_argument(
+        "--download-workers",
+        type=int,
+        default=8,
+        help="Number of cover art downloads at once",
+    )
+    parser.add_argument(
+        "--embed-cover-size",
+        type=int,
+        default=None,
+        help="Embed covers scaled down to this many pixels (default: original)",
+    )
+    parser.add_argument(
+        "--bpm-workers",
+        type=int,
+        default=None,
+        help="Number of processes used for BPM detection (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--bpm-timeout",
+        type=float,
+        default=BPM_TIMEOUT,
+        help="Maximum number of seconds to spend detecting the BPM of a file",
+    )
+    parser.add_argument(
+        "--fast-bpm",
+        action="store_true",
+        help="Detect the BPM from a few windows instead of the whole track",
+    )
+    parser.add_argument(
+        "--search-workers",
+        type=int,
+        default=SEARCH_WORKERS,
+        help="Number of Spotify searches kept in flight",
+    )
+    parser.add_argument(
+        "--search-rate",
+        type=float,
+        default=SEARCH_RATE,
+        help="Maximum number of Spotify searches per second",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Only use cached Spotify responses and skip everything else",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=DEFAULT_TTL / (24 * 60 * 60),
+        help="Number of days after which cached Spotify responses expire",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_MAX_ENTRIES,
+        help="Maximum number of cached Spotify responses",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    spotify_client = spotipy.Spotify(
+        auth_manager=SpotifyClientCredentials(
+            client_id=os.getenv("SPOTIFY_CLIENT_ID"),
+            client_secret=os.getenv("SPOTIFY_CLIENT_SECRET"),
+        ),
+        # 429 responses are handled by the shared rate limiter of the search
+        requests_session=spotify_session(),
+    )
+    # Allows running against a local mock of the Spotify API
+    spotify_client.prefix = os.getenv("SPOTIFY_API_PREFIX", spotify_client.prefix)
+
+    spotify = CachedSpotify(
+        spotify_client,
+        ttl=args.cache_ttl * 24 * 60 * 60,
+        max_entries=args.cache_size,
+        offline=args.offline,
+    )
+
+    if args.convert_first:
+        convert_library(
+            "music",
+            workers=args.convert_workers,
+            bitrate=args.bitrate,
+            codec=args.codec,
+        )
+
+    all_files = list(Path("music").glob("**/*.*"))
+
+    organizer = Organizer(args, spotify)
+    processed_files = run_pipeline(all_files, organizer.stages())
+    organizer.close()
+    spotify.close()
 
-    print(f"Processed {processed_files} out of {loaded_files} files")
+    print(f"Processed {len(processed_files)} out of {len(all_files)} files")
+    if args.incremental:
+        print(f"Skipped {organizer.unchanged_files} unchanged files")
@@ -0,0 +1,122 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+from safe_json import load_dict_from_json
+
+MATCH_CACHE_PATH = Path("matches.jsonl")
+# Cache of the best distance per name written by earlier versions
+LEGACY_DISTANCES_PATH = Path("distances.json")
+
+# The log is compacted once it has this many times more lines than entries
+COMPACT_FACTOR = 2
+# Logs with fewer lines are never compacted
+COMPACT_MIN_LINES = 1000
+
+
+class MatchCache:
+    """
+    Cache of the best Spotify match found for each normalized file name.
+
+    Every change is appended to a JSON Lines log, so recording a match costs a
+    single small write and a crash can at most lose the line being written.
+    The log is periodically rewritten atomically with only the latest entries.
+    The cache can be shared by multiple threads.
+    """
+
+    def __init__(
+        self,
+        path: Path = MATCH_CACHE_PATH,
+        legacy_path: Path = LEGACY_DISTANCES_PATH,
+    ):
+        self.path = Path(path)
+        self.entries = {}
+        self.log_lines = 0
+        self.file = None
+        self.lock = threading.Lock()
+
+        if self.path.exists():
+            clean = self._load()
+        elif Path(legacy_path).exists():
+            for name, distance in load_dict_from_json(legacy_path).items():
+                self.entries[name] = {"distance": distance, "track_id": None}
+            clean = False
+        else:
+            clean = True
+
+        # Rewrite logs with damaged lines so new lines are appended cleanly
+        if not clean:
+            self.compact()
+
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def _load(self) -> bool:
+        clean = True
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                    name = entry.pop("name")
+                except (json.JSONDecodeError, KeyError, AttributeError):
+                    print(f"Ignoring damaged line in {self.path}")
+                    clean = False
+                    continue
+                if not line.endswith("\n"):
+                    clean = False
+                self.entries[name] = entry
+                self.log_lines += 1
+        return clean
+
+    def get(self, name: str):
+        """
+        Get the cached match for a name as a dict with distance and track_id.
+        Returns None if the name was never searched.
+        """
+        return self.entries.get(name)
+
+    def record(self, name: str, distance: int, track_id: str = None):
+        """
+        Record the best distance and matched track ID for a name.
+        """
+        entry = {"distance": distance, "track_id": track_id}
+        with self.lock:
+            if self.entries.get(name) == entry:
+                return
+
+            self.entries[name] = entry
+            line = json.dumps({"name": name, **entry}, ensure_ascii=False)
+            self.file.write(line + "\n")
+            self.file.flush()
+            self.log_lines += 1
+
+            if (
+                self.log_lines >= COMPACT_MIN_LINES
+                and self.log_lines > COMPACT_FACTOR * len(self.entries)
+            ):
+                self.compact()
+
+    def compact(self):
+        """
+        Atomically rewrite the log with only the latest entry per name.
+        """
+        reopen = self.file is not None
+        if reopen:
+            self.file.close()
+
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as file:
+            for name, entry in self.entries.items():
+                file.write(json.dumps({"name": name, **entry}, ensure_ascii=False))
+                file.write("\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+        self.log_lines = len(self.entries)
+
+        if reopen:
+            self.file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        with self.lock:
+            self.file.close()
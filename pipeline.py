@@ -0,0 +1,110 @@
+import queue
+import threading
+
+from tqdm import tqdm
+
+# Maximum number of items waiting between two stages
+QUEUE_SIZE = 64
+
+_DONE = object()
+
+
+class Stage:
+    """
+    A step of a pipeline that is processed by its own worker threads.
+
+    func is called with every item, or with lists of up to batch_size items if
+    batch_size is set, and returns an iterable of the items for the next stage.
+    Exceptions raised by func are printed and the item is dropped.
+    """
+
+    def __init__(self, name: str, func, workers: int = 1, batch_size: int = None):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.batch_size = batch_size
+
+
+def run_pipeline(items, stages: list) -> list:
+    """
+    Run items through the stages, all stages working at the same time.
+
+    Stages are connected by bounded queues, so a stage waits when the next one
+    can not keep up. The progress of each stage is shown in its own bar.
+
+    Returns:
+        The items returned by the last stage.
+    """
+    queues = [queue.Queue(QUEUE_SIZE) for _ in stages]
+    results = []
+    results_lock = threading.Lock()
+    remaining_workers = [stage.workers for stage in stages]
+    workers_lock = threading.Lock()
+
+    bars = [
+        tqdm(desc=stage.name, unit="item", position=position)
+        for position, stage in enumerate(stages)
+    ]
+    if hasattr(items, "__len__"):
+        bars[0].total = len(items)
+
+    def emit(position, item):
+        if position + 1 < len(stages):
+            queues[position + 1].put(item)
+        else:
+            with results_lock:
+                results.append(item)
+
+    def process(position, item, count):
+        stage = stages[position]
+        try:
+            for output in stage.func(item) or ():
+                emit(position, output)
+        except Exception as e:
+            print(f"Error in stage {stage.name}: {e}")
+        bars[position].update(count)
+
+    def work(position):
+        stage = stages[position]
+        batch = []
+        while True:
+            item = queues[position].get()
+            if item is _DONE:
+                break
+            if stage.batch_size:
+                batch.append(item)
+                if len(batch) >= stage.batch_size:
+                    process(position, batch, len(batch))
+                    batch = []
+            else:
+                process(position, item, 1)
+        if batch:
+            process(position, batch, len(batch))
+
+        # The last worker of a stage to finish tells the next stage to finish
+        with workers_lock:
+            remaining_workers[position] -= 1
+            finished = remaining_workers[position] == 0
+        if finished and position + 1 < len(stages):
+            for _ in range(stages[position + 1].workers):
+                queues[position + 1].put(_DONE)
+
+    threads = [
+        threading.Thread(target=work, args=(position,), daemon=True)
+        for position, stage in enumerate(stages)
+        for _ in range(stage.workers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    for item in items:
+        queues[0].put(item)
+    for _ in range(stages[0].workers):
+        queues[0].put(_DONE)
+
+    for thread in threads:
+        thread.join()
+    for bar in bars:
+        bar.close()
+
+    return results
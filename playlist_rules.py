@@ -0,0 +1,119 @@
+from typing import Callable, NamedTuple
+
+import numpy as np
+
+from track_records import TrackTable
+
+
+class Playlist(NamedTuple):
+    name: str
+    description: str
+    # Rows of the TrackTable in library order
+    rows: np.ndarray
+
+
+class Bin(NamedTuple):
+    low: float
+    high: float
+    name: str
+    description: str
+
+
+class BinRule:
+    """
+    Sorts tracks into playlists by ranges of a numeric column of the table.
+
+    The bins must be contiguous and sorted. A value on the border of two bins
+    belongs to the first one, so the first bin is [low, high] and all others
+    are (low, high]. Tracks outside of all bins or without a value are not
+    in any playlist.
+    """
+
+    def __init__(self, column: str, bins: list):
+        for previous, current in zip(bins, bins[1:]):
+            if previous.high != current.low:
+                raise ValueError(f"Bins {previous.name} and {current.name} have a gap")
+        self.column = column
+        self.bins = bins
+
+    def playlists(self, table: TrackTable) -> list:
+        values = getattr(table, self.column)
+        # NaNs are sorted to the end and are never within a bin
+        order = np.argsort(values, kind="stable")
+        sorted_values = values[order]
+
+        edges = np.array([self.bins[0].low] + [bin.high for bin in self.bins])
+        starts = np.searchsorted(sorted_values, edges, side="right")
+        starts[0] = np.searchsorted(sorted_values, edges[0], side="left")
+
+        return [
+            Playlist(bin.name, bin.description, np.sort(order[start:end]))
+            for bin, start, end in zip(self.bins, starts, starts[1:])
+        ]
+
+
+class GroupRule:
+    """
+    Creates a playlist for every value of a key computed from the table, e.g.
+    the decade or the folder. Only rows where `where` is true are grouped.
+    Playlists are sorted by key, name and description are formatted with it.
+    """
+
+    def __init__(
+        self,
+        key: Callable[[TrackTable], np.ndarray],
+        name: str,
+        description: str,
+        where: Callable[[TrackTable], np.ndarray] = None,
+    ):
+        self.key = key
+        self.name = name
+        self.description = description
+        self.where = where
+
+    def playlists(self, table: TrackTable) -> list:
+        keys = self.key(table)
+        rows = np.arange(len(table))
+        if self.where is not None:
+            mask = self.where(table)
+            keys, rows = keys[mask], rows[mask]
+
+        values, groups = np.unique(keys, return_inverse=True)
+        # Rows of each group are contiguous and in library order after a
+        # stable sort by group
+        order = np.argsort(groups, kind="stable")
+        bounds = np.searchsorted(groups[order], np.arange(len(values) + 1))
+
+        return [
+            Playlist(
+                self.name.format(value),
+                self.description.format(value),
+                rows[order[start:end]],
+            )
+            for value, start, end in zip(values.tolist(), bounds, bounds[1:])
+        ]
+
+
+class FilterRule:
+    """
+    A single playlist of the tracks matching a condition on the table, e.g.
+    `lambda table: table.durations > 480` for tracks longer than 8 minutes.
+    """
+
+    def __init__(
+        self, where: Callable[[TrackTable], np.ndarray], name: str, description: str
+    ):
+        self.where = where
+        self.name = name
+        self.description = description
+
+    def playlists(self, table: TrackTable) -> list:
+        rows = np.flatnonzero(self.where(table))
+        return [Playlist(self.name, self.description, rows)]
+
+
+def evaluate_rules(rules: list, table: TrackTable) -> list:
+    """
+    Get the playlists of all rules in the order of the rules.
+    """
+    return [playlist for rule in rules for playlist in rule.playlists(table)]
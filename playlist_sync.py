@@ -0,0 +1,171 @@
+import html
+from pathlib import Path
+
+from safe_json import load_dict_from_json, save_dict_to_json
+
+PLAYLIST_STATE_PATH = Path("playlist_state.json")
+# Maximum number of items per request of the Spotify API
+PLAYLIST_BATCH_SIZE = 100
+SAVED_TRACKS_BATCH_SIZE = 50
+USER_PLAYLISTS_PAGE_SIZE = 50
+
+
+def _batches(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+class PlaylistSync:
+    """
+    Keeps Spotify playlists in sync with the desired tracks without recreating
+    them.
+
+    Playlists are found by their stored ID or by name and only the missing
+    tracks are added and the extra tracks removed. The tracks of every synced
+    playlist are stored locally together with its snapshot ID, so unchanged
+    playlists do not have to be downloaded on the next run.
+    """
+
+    def __init__(self, spotify, user_id: str, state_path: Path = PLAYLIST_STATE_PATH):
+        self.spotify = spotify
+        self.user_id = user_id
+        self.state_path = Path(state_path)
+        self.state = {"playlists": {}, "saved_tracks": []}
+        if self.state_path.exists():
+            self.state.update(load_dict_from_json(self.state_path))
+        self._user_playlists = None
+
+    def save(self):
+        save_dict_to_json(self.state, self.state_path)
+
+    def synced_playlists(self) -> set:
+        """
+        The names of the playlists synced by earlier runs.
+        """
+        return set(self.state["playlists"])
+
+    def user_playlists(self) -> dict:
+        """
+        The playlists owned by the user by ID, fetched once per run.
+        """
+        if self._user_playlists is None:
+            self._user_playlists = {}
+            page = self.spotify.current_user_playlists(limit=USER_PLAYLISTS_PAGE_SIZE)
+            while page:
+                for playlist in page["items"]:
+                    if playlist and playlist["owner"]["id"] == self.user_id:
+                        self._user_playlists[playlist["id"]] = playlist
+                page = self.spotify.next(page) if page["next"] else None
+        return self._user_playlists
+
+    def _find(self, name: str):
+        stored = self.state["playlists"].get(name)
+        playlists = self.user_playlists()
+        if stored and stored["id"] in playlists:
+            return playlists[stored["id"]]
+        for playlist in playlists.values():
+            if playlist["name"] == name:
+                return playlist
+        return None
+
+    def _playlist_tracks(self, name: str, playlist: dict) -> list:
+        stored = self.state["playlists"].get(name)
+        if (
+            stored
+            and stored["id"] == playlist["id"]
+            and stored["snapshot_id"] == playlist["snapshot_id"]
+        ):
+            return stored["tracks"]
+
+        track_ids = []
+        page = self.spotify.playlist_items(
+            playlist["id"],
+            fields="items(track(id)),next",
+            limit=PLAYLIST_BATCH_SIZE,
+            additional_types=("track",),
+        )
+        while page:
+            for item in page["items"]:
+                # Local files and unavailable tracks have no ID
+                if item["track"] and item["track"]["id"]:
+                    track_ids.append(item["track"]["id"])
+            page = self.spotify.next(page) if page["next"] else None
+        return track_ids
+
+    def sync(self, name: str, track_ids: list, description: str = "") -> str:
+        """
+        Make a playlist contain exactly the given tracks, creating it if it does
+        not exist. Returns the ID of the playlist, or None if an empty playlist
+        no longer exists.
+        """
+        desired = list(dict.fromkeys(track_ids))
+
+        playlist = self._find(name)
+        if playlist is None and not desired:
+            # There are no tracks to remove from a deleted playlist
+            if self.state["playlists"].pop(name, None):
+                self.save()
+            return None
+        if playlist is None:
+            playlist = self.spotify.user_playlist_create(
+                self.user_id, name, public=True, description=description
+            )
+            self.user_playlists()[playlist["id"]] = playlist
+            current = []
+            print(f"Created Spotify playlist: {name}")
+        else:
+            current = self._playlist_tracks(name, playlist)
+            # Spotify returns descriptions HTML escaped, e.g. & as &amp;
+            current_description = html.unescape(playlist.get("description") or "")
+            if description and current_description != description:
+                self.spotify.playlist_change_details(
+                    playlist["id"], description=description
+                )
+
+        desired_set = set(desired)
+        current_set = set(current)
+        to_remove = list(
+            dict.fromkeys(
+                track_id for track_id in current if track_id not in desired_set
+            )
+        )
+        to_add = [track_id for track_id in desired if track_id not in current_set]
+
+        snapshot_id = playlist["snapshot_id"]
+        for batch in _batches(to_remove, PLAYLIST_BATCH_SIZE):
+            snapshot_id = self.spotify.playlist_remove_all_occurrences_of_items(
+                playlist["id"], batch
+            )["snapshot_id"]
+        for batch in _batches(to_add, PLAYLIST_BATCH_SIZE):
+            snapshot_id = self.spotify.playlist_add_items(playlist["id"], batch)[
+                "snapshot_id"
+            ]
+
+        self.state["playlists"][name] = {
+            "id": playlist["id"],
+            "snapshot_id": snapshot_id,
+            "tracks": [track_id for track_id in current if track_id in desired_set]
+            + to_add,
+        }
+        self.save()
+
+        print(
+            f"Synced Spotify playlist: {name} with {len(desired)} tracks "
+            f"({len(to_add)} added, {len(to_remove)} removed)"
+        )
+        return playlist["id"]
+
+    def save_tracks(self, track_ids: list):
+        """
+        Add tracks to the user's liked songs. Tracks that were added by an
+        earlier run are not sent again.
+        """
+        saved = set(self.state["saved_tracks"])
+        to_save = [
+            track_id for track_id in dict.fromkeys(track_ids) if track_id not in saved
+        ]
+        for batch in _batches(to_save, SAVED_TRACKS_BATCH_SIZE):
+            self.spotify.current_user_saved_tracks_add(tracks=batch)
+            self.state["saved_tracks"].extend(batch)
+            self.save()
+        print(f"Added {len(to_save)} new tracks to your Spotify library")
@@ -0,0 +1,54 @@
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+RECOGNITION_CACHE_PATH = Path("recognition_cache.db")
+
+
+class RecognitionCache:
+    """
+    Cache of AudD responses on disk, keyed by the fingerprint of the audio
+    segment that was sent.
+
+    Only responses with a definite answer are stored, including "no match",
+    so a file is never sent twice for the same audio. Errors like an exceeded
+    request limit are not cached and retried on the next run.
+    """
+
+    def __init__(self, path: Path = RECOGNITION_CACHE_PATH):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS recognitions (
+                fingerprint TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def get(self, fingerprint: str):
+        """
+        Get the cached response for a fingerprint, or None if not cached.
+        """
+        row = self.connection.execute(
+            "SELECT response FROM recognitions WHERE fingerprint = ?",
+            (fingerprint,),
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, fingerprint: str, response: dict):
+        if response.get("status") != "success":
+            return
+        self.connection.execute(
+            "INSERT OR REPLACE INTO recognitions (fingerprint, response, created_at) "
+            "VALUES (?, ?, ?)",
+            (fingerprint, json.dumps(response), time.time()),
+        )
+        self.connection.commit()
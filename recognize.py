@@ -1,50 +1,149 @@
-import io
-import json
+import argparse
+import asyncio
+import hashlib
 import os
+import random
+import struct
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-import requests
+import aiohttp
 from dotenv import load_dotenv
 from mutagen.easyid3 import EasyID3
 from pydub import AudioSegment
 
+from library_index import LibraryIndex
+from recognition_cache import RecognitionCache
+from tag_scanner import UnsupportedFile, read_mp3_segment
+
 # Load environment variables
 load_dotenv()
 AUDD_API_KEY = os.getenv("AUDD_API_KEY")
+# Allows running against a local stub of the AudD API
+AUDD_API_URL = os.getenv("AUDD_API_URL", "https://api.audd.io/")
+
+# Number of requests sent to AudD at once
+REQUEST_CONCURRENCY = 4
+# Seconds after which a request is aborted
+REQUEST_TIMEOUT = 60
+# Number of attempts of a request before giving up
+MAX_ATTEMPTS = 5
+# Seconds waited before the first retry, doubled for every further retry
+RETRY_BACKOFF = 1.0
+# Responses with these status codes are retried
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def extract_audio_segment_ffmpeg(file_path, start_sec=30, duration_sec=20):
+    """
+    Extract a segment of audio as MP3 with ffmpeg. The input is seeked before
+    it is decoded, so only the segment is decoded and encoded.
+    """
+    result = subprocess.run(
+        [
+            AudioSegment.converter,
+            "-v",
+            "error",
+            "-ss",
+            str(start_sec),
+            "-t",
+            str(duration_sec),
+            "-i",
+            str(file_path),
+            "-vn",
+            "-map_metadata",
+            "-1",
+            "-f",
+            "mp3",
+            "pipe:1",
+        ],
+        capture_output=True,
+    )
+    if result.returncode:
+        raise RuntimeError(result.stderr.decode(errors="replace").strip())
+    return result.stdout
 
 
 def extract_audio_segment(file_path, start_sec=30, duration_sec=20):
-    """Extract a segment of audio from the given file."""
-    audio = AudioSegment.from_mp3(file_path)
-    segment = audio[start_sec * 1000 : (start_sec + duration_sec) * 1000]
+    """
+    Extract a segment of audio from the given file. Returns the fingerprint of
+    the segment and the segment as MP3.
 
-    # Export segment to bytes
-    buffer = io.BytesIO()
-    segment.export(buffer, format="mp3")
-    return buffer.getvalue()
+    The MP3 frames of the segment are cut out of the file without decoding it.
+    Files whose frames can not be parsed are cut with ffmpeg instead. Either
+    way memory use does not grow with the length of the file. The fingerprint
+    is a hash of the audio, so it does not depend on the tags of the file.
+    """
+    try:
+        segment = read_mp3_segment(file_path, start_sec, duration_sec)
+    except (UnsupportedFile, struct.error, IndexError, ValueError):
+        segment = extract_audio_segment_ffmpeg(file_path, start_sec, duration_sec)
+    return hashlib.sha1(segment).hexdigest(), segment
 
 
-def recognize_song(audio_data):
-    """Send audio to AudD API and get song information."""
-    url = "https://api.audd.io/"
+class AuddClient:
+    """
+    Sends audio to the AudD API with at most concurrency requests at once.
 
-    data = {
-        "api_token": AUDD_API_KEY,
-        "return": "spotify",  # Request Spotify data
-    }
+    Connection errors, timeouts and responses with a status in RETRY_STATUSES
+    are retried with exponential backoff and jitter. A Retry-After header is
+    respected if it asks for a longer wait.
+    """
 
-    files = {
-        "file": audio_data,
-    }
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        url: str = AUDD_API_URL,
+        api_token: str = AUDD_API_KEY,
+        concurrency: int = REQUEST_CONCURRENCY,
+    ):
+        self.session = session
+        self.url = url
+        self.api_token = api_token
+        self.semaphore = asyncio.Semaphore(concurrency)
 
-    try:
-        response = requests.post(url, data=data, files=files)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error making API request: {e}")
+    async def recognize_song(self, audio_data):
+        """Send audio to AudD API and get song information."""
+        error = None
+        delay = 0
+        for attempt in range(MAX_ATTEMPTS):
+            if attempt:
+                backoff = RETRY_BACKOFF * 2 ** (attempt - 1)
+                await asyncio.sleep(max(delay, backoff * random.uniform(0.5, 1.5)))
+
+            # Form data can only be sent once
+            data = aiohttp.FormData()
+            data.add_field("api_token", self.api_token or "")
+            data.add_field("return", "spotify")  # Request Spotify data
+            data.add_field("file", audio_data, filename="segment.mp3")
+
+            try:
+                async with self.semaphore, self.session.post(
+                    self.url, data=data
+                ) as response:
+                    if response.status not in RETRY_STATUSES:
+                        response.raise_for_status()
+                        return await response.json(content_type=None)
+                    error = f"{response.status}, {response.reason}"
+                    delay = _retry_after(response)
+            except aiohttp.ClientResponseError as e:
+                print(f"Error making API request: {e}")
+                return None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = str(e) or type(e).__name__
+                delay = 0
+
+        print(f"Error making API request after {MAX_ATTEMPTS} attempts: {error}")
         return None
 
 
+def _retry_after(response) -> float:
+    try:
+        return float(response.headers.get("Retry-After", 0))
+    except ValueError:
+        return 0
+
+
 def update_metadata(file_path, spotify_url):
     """Update the MP3 metadata with Spotify URL."""
     try:
@@ -57,53 +156,139 @@ def update_metadata(file_path, spotify_url):
         return False
 
 
-def has_spotify_url(file_path):
-    """Check if the file already has a Spotify URL in its metadata."""
-    try:
-        audio = EasyID3(file_path)
-        website = audio.get("website", [None])[0]
-        return website and "spotify" in website.lower()
-    except Exception:
-        return False
-
-
-def process_file(file_path):
-    """Process a single MP3 file."""
-    print(f"\nProcessing: {file_path}")
-
-    # Skip if already has Spotify URL
-    if has_spotify_url(file_path):
-        print("Skipping - already has Spotify URL")
-        return
-
-    # Extract audio segment
-    audio_data = extract_audio_segment(file_path)
+def has_spotify_url(record):
+    """Check if the indexed file already has a Spotify URL in its metadata."""
+    website = record.website
+    return bool(website) and "spotify" in website.lower()
 
-    # Recognize song
-    result = recognize_song(audio_data)
 
+def apply_result(file_path, result):
+    """Write the Spotify URL of a recognized song to the file."""
     if result and result.get("status") == "success" and result.get("result"):
         song_data = result["result"]
         spotify_data = song_data.get("spotify")
 
         if spotify_data and spotify_data.get("external_urls"):
             spotify_url = spotify_data["external_urls"]["spotify"]
-            print(f"Found match: {song_data.get('title')} by {song_data.get('artist')}")
-            print(f"Spotify URL: {spotify_url}")
+            print(
+                f"{file_path}: Found match: {song_data.get('title')} "
+                f"by {song_data.get('artist')}"
+            )
+            print(f"{file_path}: Spotify URL: {spotify_url}")
 
             # Update metadata
             if update_metadata(file_path, spotify_url):
-                print("Successfully updated metadata")
+                print(f"{file_path}: Successfully updated metadata")
             else:
-                print("Failed to update metadata")
+                print(f"{file_path}: Failed to update metadata")
         else:
-            print("No Spotify data found for this track")
+            print(f"{file_path}: No Spotify data found for this track")
     else:
-        print("No match found or error in recognition")
+        print(f"{file_path}: No match found or error in recognition")
+
 
+async def process_file(record, client, cache, pool, io, in_flight):
+    """
+    Process a single indexed MP3 file. The segment is extracted in the process
+    pool and only sent to AudD if its fingerprint is not cached. The cache and
+    the tags are accessed in the io thread, so they do not block the event loop.
+    """
+    file_path = record.path
+    loop = asyncio.get_running_loop()
 
-def process_files():
-    """Process all MP3 files in the unprocessed folder and its subdirectories."""
+    # Limits the number of extracted segments held in memory
+    async with in_flight:
+        try:
+            fingerprint, audio_data = await loop.run_in_executor(
+                pool, extract_audio_segment, file_path
+            )
+        except Exception as e:
+            print(f"{file_path}: Error extracting audio: {e}")
+            return
+        if not audio_data:
+            print(f"{file_path}: Too short to extract a segment")
+            return
+
+        result = await loop.run_in_executor(io, cache.get, fingerprint)
+        if result is None:
+            result = await client.recognize_song(audio_data)
+            if result is not None:
+                await loop.run_in_executor(io, cache.put, fingerprint, result)
+
+    await loop.run_in_executor(io, apply_result, file_path, result)
+
+
+async def recognize_files(records, workers=None, concurrency=REQUEST_CONCURRENCY):
+    """Recognize the files of the records concurrently."""
+    loop = asyncio.get_running_loop()
+    in_flight = asyncio.Semaphore((workers or os.cpu_count() or 1) + 2 * concurrency)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+
+    # A single thread owns the cache connection and writes the tags one by one,
+    # which also keeps the messages of a file together
+    with ThreadPoolExecutor(max_workers=1) as io:
+        cache = await loop.run_in_executor(io, RecognitionCache)
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                async with aiohttp.ClientSession(timeout=timeout) as session:
+                    client = AuddClient(session, concurrency=concurrency)
+                    await asyncio.gather(
+                        *(
+                            process_file(record, client, cache, pool, io, in_flight)
+                            for record in records
+                        )
+                    )
+        finally:
+            await loop.run_in_executor(io, cache.close)
+
+
+def match_locally(records, pending, workers=None):
+    """
+    Give files that sound like a file with a Spotify URL the same URL, using
+    the local fingerprint index instead of AudD. Returns the files that are
+    still unrecognized.
+    """
+    websites = {
+        record.path: record.website for record in records if has_spotify_url(record)
+    }
+    if not websites or not pending:
+        return pending
+
+    # Imported here, so --no-local-match does not load librosa
+    from fingerprint_index import FingerprintIndex
+
+    index = FingerprintIndex()
+    try:
+        index.update(records, workers=workers)
+        remaining = []
+        for record in pending:
+            match = next(
+                (path for path, _ in index.match_file(record.path) if path in websites),
+                None,
+            )
+            if match is None:
+                remaining.append(record)
+                continue
+
+            print(f"{record.path}: Sounds like {match}")
+            print(f"{record.path}: Spotify URL: {websites[match]}")
+            if update_metadata(record.path, websites[match]):
+                print(f"{record.path}: Successfully updated metadata")
+            else:
+                print(f"{record.path}: Failed to update metadata")
+    finally:
+        index.close()
+
+    print(f"Matched {len(pending) - len(remaining)} files locally")
+    return remaining
+
+
+def process_files(workers=None, concurrency=REQUEST_CONCURRENCY, local_match=True):
+    """
+    Process all MP3 files in the unprocessed folder and its subdirectories.
+    Unless local_match is False, files are first matched against the files that
+    already have a Spotify URL.
+    """
     unprocessed_dir = "music"
 
     # Create unprocessed directory if it doesn't exist
@@ -112,22 +297,55 @@ def process_files():
         os.makedirs(unprocessed_dir)
         return
 
-    # Walk through all directories and subdirectories
-    for root, _, files in os.walk(unprocessed_dir):
-        # Filter for MP3 files
-        mp3_files = [f for f in files if f.lower().endswith(".mp3")]
-
-        for file_name in mp3_files:
-            file_path = os.path.join(root, file_name)
-            process_file(file_path)
+    # Get all MP3 files in all directories and subdirectories from the index
+    index = LibraryIndex()
+    records = index.scan(unprocessed_dir)
+    index.close()
 
-    if not any(
-        f.lower().endswith(".mp3")
-        for _, _, files in os.walk(unprocessed_dir)
-        for f in files
-    ):
+    if not records:
         print("No MP3 files found in the unprocessed directory or its subdirectories.")
+        return
+
+    # Skip files that already have a Spotify URL
+    pending = [record for record in records if not has_spotify_url(record)]
+    print(f"Skipping {len(records) - len(pending)} files with a Spotify URL")
+
+    # Copies of tagged files are recognized without sending them to AudD
+    if local_match:
+        pending = match_locally(records, pending, workers=workers)
+
+    asyncio.run(recognize_files(pending, workers=workers, concurrency=concurrency))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Recognize songs with AudD and add their Spotify URLs."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes fingerprinting and extracting audio "
+        "(default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=REQUEST_CONCURRENCY,
+        help="Number of requests sent to AudD at once",
+    )
+    parser.add_argument(
+        "--no-local-match",
+        action="store_true",
+        help="Send all files to AudD instead of first matching them locally",
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    process_files()
+    args = parse_args()
+    process_files(
+        workers=args.workers,
+        concurrency=args.concurrency,
+        local_match=not args.no_local_match,
+    )
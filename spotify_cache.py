@@ -0,0 +1,174 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+SPOTIFY_CACHE_PATH = Path("spotify_cache.db")
+# Seconds after which a cached response is fetched again
+DEFAULT_TTL = 30 * 24 * 60 * 60
+# Maximum number of cached responses, the least recently used are evicted
+DEFAULT_MAX_ENTRIES = 200000
+# Number of writes between checks of the cache size
+EVICTION_INTERVAL = 100
+# Number of cache hits whose access times are written at once
+ACCESS_FLUSH_INTERVAL = 100
+
+
+class SpotifyCacheMiss(Exception):
+    pass
+
+
+class CachedSpotify:
+    """
+    Wraps a spotipy client and caches the responses of search and tracks calls
+    on disk. All other methods are passed through to the client.
+
+    Responses are keyed by endpoint, query and market. Tracks are cached one by
+    one, so batches with a different mix of IDs still reuse cached tracks.
+    In offline mode uncached searches raise SpotifyCacheMiss instead of
+    reaching the API, and uncached tracks are returned as None.
+    """
+
+    def __init__(
+        self,
+        spotify,
+        path: Path = SPOTIFY_CACHE_PATH,
+        ttl: float = DEFAULT_TTL,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        offline: bool = False,
+    ):
+        self.spotify = spotify
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.offline = offline
+        self.writes = 0
+        # Access times of cache hits that are not written yet, by key
+        self.accessed = {}
+        self.hits = 0
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed_at "
+            "ON responses (accessed_at)"
+        )
+        self.connection.commit()
+
+    def __getattr__(self, name):
+        return getattr(self.spotify, name)
+
+    def close(self):
+        with self.lock:
+            self._flush_accessed()
+            self.connection.commit()
+            self.connection.close()
+
+    def _get(self, key: str):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            # Expired responses are still used when offline
+            if now - created_at > self.ttl and not self.offline:
+                return None
+            # Writing every hit would keep a write transaction open
+            self.accessed[key] = now
+            self.hits += 1
+            if self.hits >= ACCESS_FLUSH_INTERVAL:
+                self._flush_accessed()
+                self.connection.commit()
+        return json.loads(value)
+
+    def _flush_accessed(self):
+        self.connection.executemany(
+            "UPDATE responses SET accessed_at = ? WHERE key = ?",
+            [(accessed_at, key) for key, accessed_at in self.accessed.items()],
+        )
+        self.accessed.clear()
+        self.hits = 0
+
+    def _put_many(self, items: list):
+        now = time.time()
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO responses "
+                "(key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                [(key, json.dumps(value), now, now) for key, value in items],
+            )
+            self.writes += len(items)
+            if self.writes >= EVICTION_INTERVAL:
+                self.writes = 0
+                # Evict by the latest access times
+                self._flush_accessed()
+                self._evict()
+            self.connection.commit()
+
+    def _evict(self):
+        count = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.max_entries:
+            self.connection.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def _miss(self, key: str):
+        if self.offline:
+            raise SpotifyCacheMiss(f"Not cached: {key}")
+
+    def cached_search(self, q, limit=10, offset=0, type="track", market=None):
+        """
+        Get a cached search response without sending a request.
+        Returns None if the search is not cached.
+        """
+        return self._get(json.dumps(["search", q, limit, offset, type, market]))
+
+    def search(self, q, limit=10, offset=0, type="track", market=None):
+        key = json.dumps(["search", q, limit, offset, type, market])
+        response = self._get(key)
+        if response is None:
+            self._miss(key)
+            response = self.spotify.search(
+                q=q, limit=limit, offset=offset, type=type, market=market
+            )
+            self._put_many([(key, response)])
+        return response
+
+    def tracks(self, tracks, market=None):
+        keys = [json.dumps(["track", track_id, market]) for track_id in tracks]
+        cached = [self._get(key) for key in keys]
+
+        missing = [track_id for track_id, track in zip(tracks, cached) if track is None]
+        # Like the API does for unknown IDs, uncached tracks are None offline
+        if missing and not self.offline:
+            fetched = dict(
+                zip(missing, self.spotify.tracks(missing, market=market)["tracks"])
+            )
+            self._put_many(
+                [
+                    (key, fetched[track_id])
+                    for key, track_id in zip(keys, tracks)
+                    if track_id in fetched and fetched[track_id] is not None
+                ]
+            )
+            cached = [
+                track if track is not None else fetched[track_id]
+                for track_id, track in zip(tracks, cached)
+            ]
+
+        return {"tracks": cached}
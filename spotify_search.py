@@ -0,0 +1,106 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from spotipy import SpotifyException
+from urllib3.util.retry import Retry
+
+# Default number of search requests kept in flight
+SEARCH_WORKERS = 8
+# Default number of requests per second across all workers
+SEARCH_RATE = 10
+# Retries of a single request after the API responded with 429
+MAX_RETRIES = 5
+# Seconds to wait after a 429 response without a Retry-After header
+DEFAULT_RETRY_AFTER = 1
+# Retries of connection errors and 5xx responses by the HTTP session
+SESSION_RETRIES = 3
+
+
+class TokenBucket:
+    """
+    Rate limiter shared by all threads sending requests to the same API.
+
+    Allows bursts of up to capacity requests and rate requests per second on
+    average. pause() blocks all threads, e.g. after a 429 response.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(
+                        self.capacity,
+                        self.tokens + (now - self.updated_at) * self.rate,
+                    )
+                    self.updated_at = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.paused_until - now
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.updated_at = self.paused_until
+
+
+def spotify_session(retries: int = SESSION_RETRIES) -> requests.Session:
+    """
+    HTTP session for spotipy that retries connection errors and 5xx responses
+    but never 429 responses, not even those with a Retry-After header. Those
+    are left to search_track, so all threads pause together.
+    """
+    retry = Retry(
+        total=retries,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]),
+        status=retries,
+        backoff_factor=0.3,
+        status_forcelist=(500, 502, 503, 504),
+        respect_retry_after_header=False,
+    )
+    session = requests.Session()
+    adapter = HTTPAdapter(max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _retry_after(error: SpotifyException) -> float:
+    headers = error.headers or {}
+    try:
+        return float(headers.get("Retry-After", DEFAULT_RETRY_AFTER))
+    except ValueError:
+        return DEFAULT_RETRY_AFTER
+
+
+def search_track(spotify, query: str, rate_limiter: TokenBucket, market="DE"):
+    """
+    Search for a track, waiting for the rate limiter before every request and
+    pausing all requests when the API responds with 429 Too Many Requests.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        rate_limiter.acquire()
+        try:
+            return spotify.search(q=query, type="track", market=market)
+        except SpotifyException as e:
+            if e.http_status != 429 or attempt == MAX_RETRIES:
+                raise
+            rate_limiter.pause(_retry_after(e))
+
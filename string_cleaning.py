@@ -1,19 +1,14 @@
 import re
+from functools import lru_cache
 
+# Number of normalized strings kept in memory
+CACHE_SIZE = 65536
 
-def clean_string_for_filename(string: str) -> str:
-    """
-    Cleans a string for use as a filename by removing invalid characters.
-    """
-    clean = re.sub(r"[/\\?%*:|\"<>\x7F\x00-\x1F]", "", string)
-    return clean
-
+INVALID_FILENAME_CHARS = re.compile(r"[/\\?%*:|\"<>\x7F\x00-\x1F]")
 
-def remove_song_version_info(song_title: str) -> str:
-    """
-    Removes remaster information from a song title.
-    """
-    patterns = [
+VERSION_INFO_PATTERNS = [
+    re.compile(pattern)
+    for pattern in [
         r" - Remastered \d{4}",  # Matches " - Remastered 2020"
         r" \(Remastered \d{4}\)",  # Matches " (Remastered 2020)"
         r" - \d{4} Remaster",  # Matches " - 2020 Remaster"
@@ -24,49 +19,85 @@ def remove_song_version_info(song_title: str) -> str:
         r" - Radio Edit$",  # Matches " - Radio Edit" at the end
         r" \(Radio Edit\)",  # Matches " (Radio Edit)"
     ]
+]
+
+# Matches if any of the version info patterns matches, most titles have no
+# version info and are done after this single search
+ANY_VERSION_INFO = re.compile(
+    "|".join(f"(?:{pattern.pattern})" for pattern in VERSION_INFO_PATTERNS)
+)
+
+# Replace & with "and", convert ä to ae, ö to oe, ü to ue, ß to ss
+CHARACTER_REPLACEMENTS = str.maketrans(
+    {"&": "and", "ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"}
+)
+NON_ALPHANUMERIC = re.compile(r"[^a-zA-Z0-9\s]")
+ARTICLES = re.compile(r"\b(the|der|die|das)\b")
+WHITESPACE = re.compile(r"\s+")
+
+# Artist names that are replaced after normalization, applied in order
+ARTIST_ALIASES = {
+    "yusuf cat stevens": "cat stevens",
+    "bob marley and wailers": "bob marley",
+}
+
+
+def set_artist_aliases(aliases: dict):
+    """
+    Replace the artist aliases used by normalize_string.
+    """
+    ARTIST_ALIASES.clear()
+    ARTIST_ALIASES.update(aliases)
+    normalize_string.cache_clear()
 
-    # Apply each pattern and remove matches
-    for pattern in patterns:
-        song_title = re.sub(pattern, "", song_title)
+
+def clean_string_for_filename(string: str) -> str:
+    """
+    Cleans a string for use as a filename by removing invalid characters.
+    """
+    clean = INVALID_FILENAME_CHARS.sub("", string)
+    return clean
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def remove_song_version_info(song_title: str) -> str:
+    """
+    Removes remaster information from a song title.
+    """
+    if ANY_VERSION_INFO.search(song_title):
+        # Apply each pattern and remove matches
+        for pattern in VERSION_INFO_PATTERNS:
+            song_title = pattern.sub("", song_title)
 
     # Remove trailing or extra spaces
     return song_title.strip()
 
 
+@lru_cache(maxsize=CACHE_SIZE)
 def normalize_string(input_string: str) -> str:
     """
     Normalize a string by replacing & with "and", removing non-alphanumeric characters,
     converting to lowercase, and replacing duplicate whitespace with a single space.
-    Also removes English and German articles.
+    Also removes English and German articles and replaces artist aliases.
     """
-    # Replace & with "and"
-    input_string = re.sub(r"&", "and", input_string)
-    # Convert ä to ae, ö to oe, ü to ue, ß to ss
-    input_string = re.sub(r"ä", "ae", input_string)
-    input_string = re.sub(r"ö", "oe", input_string)
-    input_string = re.sub(r"ü", "ue", input_string)
-    input_string = re.sub(r"ß", "ss", input_string)
+    input_string = input_string.translate(CHARACTER_REPLACEMENTS)
 
     # Remove non-alphanumeric characters, allowing spaces
-    clean_string = re.sub(r"[^a-zA-Z0-9\s]", "", input_string)
+    clean_string = NON_ALPHANUMERIC.sub("", input_string)
     # Convert to lowercase
     clean_string = clean_string.lower()
 
     # Remove English and German articles
-    clean_string = re.sub(r"\b(the|der|die|das)\b", "", clean_string)
+    clean_string = ARTICLES.sub("", clean_string)
 
     # Replace multiple spaces with a single space
-    normalized_string = re.sub(r"\s+", " ", clean_string).strip()
-
-    # Replace "yusuf cat stevens" with "cat stevens"
-    normalized_string = re.sub(r"yusuf cat stevens", "cat stevens", normalized_string)
+    normalized_string = WHITESPACE.sub(" ", clean_string).strip()
 
-    # Replace "bob marley the wailers" with "bob marley"
-    normalized_string = re.sub(
-        r"bob marley and wailers", "bob marley", normalized_string
-    )
+    # Replace artist aliases like "yusuf cat stevens" with "cat stevens"
+    for alias, artist in ARTIST_ALIASES.items():
+        normalized_string = normalized_string.replace(alias, artist)
 
     # Replace multiple spaces with a single space
-    normalized_string = re.sub(r"\s+", " ", normalized_string).strip()
+    normalized_string = WHITESPACE.sub(" ", normalized_string).strip()
 
     return normalized_string
@@ -0,0 +1,423 @@
+import hashlib
+import os
+import re
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+from mutagen.mp3 import MP3
+
+from spotify_track_id import extract_spotify_track_id
+from track_records import TrackRecord
+
+# Files read at once by scan_files, mostly waiting for the disk or network
+SCAN_WORKERS = 16
+
+# ID3v2 frames read by the fast scanner, all others are skipped without reading
+WANTED_FRAMES = {b"TIT2", b"TPE1", b"TBPM", b"TYER", b"TDRC", b"WOAR"}
+# Embedded covers are identified by their size and this many first bytes
+COVER_HASH_BYTES = 4096
+# Bytes read from the start of a picture frame, enough for its header as well
+APIC_HEAD_BYTES = COVER_HASH_BYTES + 1024
+# Bytes of audio hashed to tell if only the tags of a file changed
+AUDIO_DIGEST_BYTES = 64 * 1024
+FRAME_ID = re.compile(rb"[A-Z0-9]{4}")
+TEXT_ENCODINGS = {0: "latin-1", 1: "utf-16", 2: "utf-16-be", 3: "utf-8"}
+
+# MPEG audio Layer III bitrates in kbit/s by bitrate index
+MPEG1_BITRATES = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+MPEG2_BITRATES = (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+# Sample rates by MPEG version bits and sample rate index
+SAMPLE_RATES = {
+    3: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    0: (11025, 12000, 8000),
+}
+
+
+class UnsupportedFile(Exception):
+    """The file uses a feature the fast scanner does not handle."""
+
+
+def get_year_from_id3(audio_id3, file_path):
+    """Extract year from ID3 tags, returns None if no valid year is found."""
+    try:
+        # Try TYER tag first
+        if "TYER" in audio_id3 and audio_id3["TYER"].text[0]:
+            return int(str(audio_id3["TYER"].text[0]).strip())
+        # Fall back to TDRC if TYER is not available
+        elif "TDRC" in audio_id3 and audio_id3["TDRC"].text[0]:
+            return int(str(audio_id3["TDRC"].text[0]).split("-")[0])
+        return None
+    except (ValueError, TypeError, IndexError):
+        print(f"Invalid year format in tags for {file_path}")
+        return None
+
+
+def _first_text(tags, frame_id):
+    frame = tags.get(frame_id)
+    if frame is None or not frame.text:
+        return None
+    return str(frame.text[0])
+
+
+def cover_hash(picture: bytes, size: int) -> str:
+    """
+    Identify a cover by its size and first bytes, so the whole picture does
+    not have to be read to tell covers apart.
+    """
+    data = size.to_bytes(8, "big") + picture[:COVER_HASH_BYTES]
+    return hashlib.sha1(data).hexdigest()
+
+
+def _set_website(info: dict, website: str):
+    info["website"] = website
+    if "spotify" in website and "track/" in website:
+        info["spotify_id"] = extract_spotify_track_id(website)
+
+
+def _set_bpm(info: dict, bpm: str, file_path):
+    try:
+        info["bpm"] = float(bpm)
+    except ValueError:
+        print(f"Invalid BPM format in tags for {file_path}")
+
+
+def read_track_info_mutagen(file_path) -> TrackRecord:
+    """
+    Read the fields used by the scripts from an MP3 file with mutagen.
+    """
+    stat = os.stat(file_path)
+    info = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    try:
+        audio = MP3(file_path)
+    except Exception as e:
+        return TrackRecord(str(file_path), error=str(e), **info)
+
+    info["duration"] = audio.info.length
+
+    tags = audio.tags
+    if tags is None:
+        return TrackRecord(str(file_path), **info)
+
+    websites = [frame.url for frame in tags.getall("WOAR")]
+    if websites:
+        _set_website(info, websites[0])
+
+    bpm = _first_text(tags, "TBPM")
+    if bpm:
+        _set_bpm(info, bpm, file_path)
+
+    info["year"] = get_year_from_id3(tags, file_path)
+    info["title"] = _first_text(tags, "TIT2")
+    info["artist"] = _first_text(tags, "TPE1")
+    pictures = tags.getall("APIC")
+    info["has_cover"] = bool(pictures)
+    if pictures:
+        info["cover_hash"] = cover_hash(pictures[0].data, len(pictures[0].data))
+
+    return TrackRecord(str(file_path), **info)
+
+
+def _syncsafe(data: bytes) -> int:
+    return data[0] << 21 | data[1] << 14 | data[2] << 7 | data[3]
+
+
+def _decode_text(data: bytes) -> str:
+    """
+    Decode the first value of an ID3 text frame.
+    """
+    encoding = TEXT_ENCODINGS.get(data[0])
+    if encoding is None:
+        raise UnsupportedFile(f"Unknown text encoding {data[0]}")
+    text = data[1:]
+    if encoding.startswith("utf-16") and len(text) % 2:
+        text = text[:-1]
+    return text.decode(encoding).split("\x00")[0]
+
+
+def _read_id3v2(f) -> tuple[dict, tuple, int]:
+    """
+    Read the wanted frames of the ID3v2 tag at the start of a file.
+
+    Returns:
+        The raw data of the wanted frames by frame ID, the start and size of
+        the first picture frame or None and the offset of the audio data.
+        Files without a tag have no frames and their audio data starts at 0.
+    """
+    header = f.read(10)
+    if header[:3] != b"ID3":
+        return {}, None, 0
+    version, flags = header[3], header[5]
+    if version not in (3, 4):
+        raise UnsupportedFile(f"ID3v2.{version} tag")
+    if flags & 0x80:
+        raise UnsupportedFile("Unsynchronised tag")
+
+    end = 10 + _syncsafe(header[6:10])
+    audio_offset = end + 10 if version == 4 and flags & 0x10 else end
+
+    if flags & 0x40:
+        size = f.read(4)
+        if version == 3:
+            f.seek(struct.unpack(">I", size)[0], os.SEEK_CUR)
+        else:
+            f.seek(_syncsafe(size) - 4, os.SEEK_CUR)
+
+    frames = {}
+    picture = None
+    while f.tell() + 10 <= end:
+        frame_header = f.read(10)
+        frame_id = frame_header[:4]
+        if frame_id == b"\x00\x00\x00\x00":
+            break  # Padding
+        if not FRAME_ID.fullmatch(frame_id):
+            raise UnsupportedFile(f"Invalid frame {frame_id!r}")
+
+        if version == 3:
+            size = struct.unpack(">I", frame_header[4:8])[0]
+            unsupported = frame_header[9] & 0xC0
+            extra = 1 if frame_header[9] & 0x20 else 0
+        else:
+            size = _syncsafe(frame_header[4:8])
+            unsupported = frame_header[9] & 0x0E
+            extra = (1 if frame_header[9] & 0x40 else 0) + (
+                4 if frame_header[9] & 0x01 else 0
+            )
+        if f.tell() + size > end:
+            raise UnsupportedFile(f"Frame {frame_id!r} exceeds the tag")
+
+        wanted = frame_id in WANTED_FRAMES and frame_id not in frames
+        first_picture = frame_id == b"APIC" and picture is None
+        if (wanted or first_picture) and unsupported:
+            raise UnsupportedFile(f"Compressed or encrypted frame {frame_id!r}")
+
+        if wanted:
+            frames[frame_id] = f.read(size)[extra:]
+        elif first_picture:
+            # Only the start of the picture is needed for its hash
+            head = f.read(min(size, APIC_HEAD_BYTES))
+            f.seek(size - len(head), os.SEEK_CUR)
+            picture = (head[extra:], size - extra)
+        else:
+            f.seek(size, os.SEEK_CUR)
+
+    return frames, picture, audio_offset
+
+
+def _picture_hash(head: bytes, frame_size: int) -> str:
+    """
+    Hash of the image in a picture frame, given the start of the frame.
+    """
+    # Encoding, MIME type, picture type and description precede the image
+    encoding = head[0]
+    description_start = head.index(b"\x00", 1) + 2
+    if encoding in (1, 2):
+        end = description_start
+        while head[end : end + 2] != b"\x00\x00":
+            end += 2
+            if end >= len(head):
+                raise UnsupportedFile("Picture description too long")
+        image_start = end + 2
+    else:
+        image_start = head.index(b"\x00", description_start) + 1
+    return cover_hash(head[image_start:], frame_size - image_start)
+
+
+def _frame_header(header: bytes) -> tuple[int, int, int, int]:
+    """
+    Parse the header of an MPEG Layer III frame. Returns its bitrate in kbit/s,
+    sample rate, number of samples and length in bytes.
+    """
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        raise UnsupportedFile("No MPEG frame sync")
+
+    version = header[1] >> 3 & 3
+    layer = header[1] >> 1 & 3
+    bitrate_index = header[2] >> 4
+    sample_rate_index = header[2] >> 2 & 3
+    padding = header[2] >> 1 & 1
+    if version == 1 or layer != 1 or bitrate_index in (0, 15):
+        raise UnsupportedFile("Not an MPEG Layer III file")
+    if sample_rate_index == 3:
+        raise UnsupportedFile("Invalid sample rate")
+
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    if version == 3:
+        bitrate = MPEG1_BITRATES[bitrate_index]
+        samples_per_frame = 1152
+    else:
+        bitrate = MPEG2_BITRATES[bitrate_index]
+        samples_per_frame = 576
+    length = samples_per_frame // 8 * bitrate * 1000 // sample_rate + padding
+    return bitrate, sample_rate, samples_per_frame, length
+
+
+def _xing_offset(frame: bytes) -> int:
+    mono = frame[3] >> 6 == 3
+    if frame[1] >> 3 & 3 == 3:
+        return 21 if mono else 36
+    return 13 if mono else 21
+
+
+def _is_info_frame(frame: bytes) -> bool:
+    """Whether a frame holds a Xing, Info or VBRI header instead of audio."""
+    return frame[_xing_offset(frame) :][:4] in (b"Xing", b"Info") or (
+        frame[36:40] == b"VBRI"
+    )
+
+
+def _read_duration(f, audio_offset: int, file_size: int) -> float:
+    """
+    Get the duration of the MPEG audio starting at audio_offset from its
+    Xing, Info or VBRI header, or estimate it from the bitrate for CBR files.
+    """
+    f.seek(audio_offset)
+    frame = f.read(192)
+    if len(frame) < 4 or frame[0] != 0xFF or frame[1] & 0xE0 != 0xE0:
+        raise UnsupportedFile("No MPEG frame after the tag")
+
+    bitrate, sample_rate, samples_per_frame, _ = _frame_header(frame)
+    xing = frame[_xing_offset(frame) :]
+    if xing[:4] in (b"Xing", b"Info"):
+        flags = struct.unpack(">I", xing[4:8])[0]
+        if flags & 1:
+            frames = struct.unpack(">I", xing[8:12])[0]
+            samples = frames * samples_per_frame
+
+            # LAME stores the encoder delay and padding after the Xing fields
+            lame = 8 + 4 * bin(flags & 0b1011).count("1") + (100 if flags & 4 else 0)
+            if xing[lame:].startswith((b"LAME", b"L3.99")) and len(xing) >= lame + 24:
+                delay = int.from_bytes(xing[lame + 21 : lame + 24], "big")
+                samples -= (delay >> 12) + (delay & 0xFFF)
+            return max(samples, 0) / sample_rate
+
+    if frame[36:40] == b"VBRI" and frame[40:42] == b"\x00\x01":
+        frames = struct.unpack(">I", frame[50:54])[0]
+        return frames * samples_per_frame / sample_rate
+
+    return 8 * (file_size - audio_offset) / (bitrate * 1000)
+
+
+def read_mp3_segment(file_path, start_sec: float, duration_sec: float) -> bytes:
+    """
+    Cut a segment out of an MP3 file without decoding it. The frame headers
+    are walked from the start of the audio to find the frames of the segment,
+    which are then read in one piece, so memory use only depends on the length
+    of the segment. The segment has no tags. Its first frames can refer to
+    data of the frames before them, which decoders treat as a short glitch.
+
+    Returns an empty segment if the audio ends before start_sec.
+    """
+    with open(file_path, "rb") as f:
+        _, _, position = _read_id3v2(f)
+
+        f.seek(position)
+        header = f.read(192)
+        # Raises UnsupportedFile if no MPEG audio follows the tag
+        length = _frame_header(header)[3]
+        if _is_info_frame(header):
+            position += length
+
+        elapsed = 0.0
+        start = None
+        while True:
+            if start is None and elapsed >= start_sec:
+                start = position
+            if start is not None and elapsed >= start_sec + duration_sec:
+                break
+            f.seek(position)
+            try:
+                _, sample_rate, samples, length = _frame_header(f.read(4))
+            except UnsupportedFile:
+                # End of the audio, an ID3v1 tag or garbage
+                break
+            elapsed += samples / sample_rate
+            position += length
+
+        if start is None:
+            return b""
+        f.seek(start)
+        return f.read(position - start)
+
+
+def audio_digest(file_path, length: int = AUDIO_DIGEST_BYTES) -> str:
+    """
+    Hash of the start of the audio of a file, skipping the ID3v2 tag. It does
+    not change when the tags of the file are rewritten.
+    """
+    with open(file_path, "rb") as f:
+        _, _, audio_offset = _read_id3v2(f)
+        f.seek(audio_offset)
+        return hashlib.sha1(f.read(length)).hexdigest()
+
+
+def _read_track_info_fast(file_path) -> TrackRecord:
+    info = {}
+    with open(file_path, "rb") as f:
+        frames, picture, audio_offset = _read_id3v2(f)
+        info["has_cover"] = picture is not None
+        if picture is not None:
+            info["cover_hash"] = _picture_hash(*picture)
+
+        stat = os.fstat(f.fileno())
+        file_size = info["size"] = stat.st_size
+        info["mtime_ns"] = stat.st_mtime_ns
+        info["duration"] = _read_duration(f, audio_offset, file_size)
+
+        text = {
+            frame_id.decode(): _decode_text(data)
+            for frame_id, data in frames.items()
+            if frame_id != b"WOAR" and data
+        }
+
+        # mutagen fills in missing fields from an ID3v1 tag
+        year = text.get("TYER") or text.get("TDRC")
+        if not (text.get("TIT2") and text.get("TPE1") and year):
+            f.seek(max(file_size - 128, 0))
+            if f.read(3) == b"TAG":
+                raise UnsupportedFile("Incomplete ID3v2 tag and ID3v1 tag")
+
+    if b"WOAR" in frames:
+        _set_website(info, frames[b"WOAR"].split(b"\x00")[0].decode("latin-1"))
+    if text.get("TBPM"):
+        _set_bpm(info, text["TBPM"], file_path)
+
+    try:
+        if text.get("TYER"):
+            info["year"] = int(text["TYER"].strip())
+        elif text.get("TDRC"):
+            info["year"] = int(text["TDRC"].split("-")[0])
+    except ValueError:
+        print(f"Invalid year format in tags for {file_path}")
+
+    info["title"] = text.get("TIT2")
+    info["artist"] = text.get("TPE1")
+    return TrackRecord(str(file_path), **info)
+
+
+def read_track_info(file_path) -> TrackRecord:
+    """
+    Read the fields used by the scripts from an MP3 file.
+
+    Only the wanted ID3v2 frames and the first MPEG frame are read. Files the
+    fast scanner does not handle are read with mutagen instead.
+    """
+    try:
+        try:
+            return _read_track_info_fast(file_path)
+        except (UnsupportedFile, struct.error, IndexError, ValueError):
+            return read_track_info_mutagen(file_path)
+    except OSError as e:
+        return TrackRecord(str(file_path), error=str(e))
+
+
+def scan_files(paths: list, workers: int = SCAN_WORKERS):
+    """
+    Read many files concurrently so the waits for the storage overlap.
+
+    Yields:
+        (path, TrackRecord) tuples in the order of paths.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from zip(paths, executor.map(read_track_info, paths))
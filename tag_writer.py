@@ -0,0 +1,126 @@
+import hashlib
+import os
+from functools import lru_cache
+from pathlib import Path
+
+from mutagen.id3 import (
+    APIC,
+    ID3,
+    TALB,
+    TBPM,
+    TIT2,
+    TORY,
+    TPE1,
+    TPOS,
+    TRCK,
+    TSRC,
+    TYER,
+    WOAR,
+    ID3NoHeaderError,
+    TextFrame,
+    UrlFrame,
+)
+
+from track_records import SpotifyTrack
+
+
+def frame_value(frame):
+    """
+    The part of a frame that is compared to decide if it changed. Encodings
+    are ignored, they are converted anyway when saving as ID3v2.3.
+    """
+    if isinstance(frame, TextFrame):
+        return [str(text) for text in frame.text]
+    if isinstance(frame, UrlFrame):
+        return frame.url
+    return frame
+
+
+@lru_cache(maxsize=4096)
+def _file_digest(path: str, mtime_ns: int, size: int) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def file_digest(path: Path) -> str:
+    """
+    SHA-1 of a file's content, cached as long as the file is not modified.
+    """
+    stat = os.stat(path)
+    return _file_digest(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+def has_cover(tags: ID3, cover_image_path: Path) -> bool:
+    """
+    Check if the image is already embedded as the front cover, comparing
+    hashes so the image file only has to be read once per album.
+    """
+    existing = tags.getall("APIC:Cover")
+    if len(existing) != 1 or (existing[0].mime, existing[0].type) != ("image/jpeg", 3):
+        return False
+    return hashlib.sha1(existing[0].data).hexdigest() == file_digest(cover_image_path)
+
+
+def build_frames(track: SpotifyTrack) -> list:
+    """
+    Build the ID3 frames describing a Spotify track.
+    """
+    year = str(track.year)
+    frames = [
+        TIT2(encoding=3, text=[track.name]),
+        TPE1(encoding=3, text=[track.artist]),
+        TALB(encoding=3, text=[track.album_name]),
+        WOAR(url=track.url),
+        TRCK(encoding=3, text=[str(track.track_number)]),
+        TPOS(encoding=3, text=[str(track.disc_number)]),
+        TORY(encoding=3, text=[year]),
+        TYER(encoding=3, text=[year]),
+    ]
+    if track.isrc:
+        frames.append(TSRC(encoding=3, text=[track.isrc]))
+    return frames
+
+
+def write_track_tags(
+    file: Path, track: SpotifyTrack, cover_image_path: Path, bpm: int = None
+) -> bool:
+    """
+    Write the tags of a Spotify track and its cover to an MP3 file as ID3v2.3.
+
+    The file is opened once and saved once, and not saved at all if all tags
+    already have the right values. The BPM is only written if it is missing.
+
+    Returns:
+        True if the file was written.
+    """
+    try:
+        tags = ID3(file, v2_version=3)
+        changed = tags.version[:2] != (2, 3)
+    except ID3NoHeaderError:
+        tags = ID3()
+        changed = True
+
+    frames = build_frames(track)
+    if bpm is not None and "TBPM" not in tags:
+        frames.append(TBPM(encoding=3, text=[str(bpm)]))
+
+    for frame in frames:
+        # URL frames are keyed by their URL, all other websites are replaced.
+        key = frame.FrameID if isinstance(frame, UrlFrame) else frame.HashKey
+        existing = tags.getall(key)
+        if len(existing) != 1 or frame_value(existing[0]) != frame_value(frame):
+            tags.setall(key, [frame])
+            changed = True
+
+    # Other pictures than the front cover are kept
+    if not has_cover(tags, cover_image_path):
+        with open(cover_image_path, "rb") as f:
+            cover = APIC(
+                encoding=3, mime="image/jpeg", type=3, desc="Cover", data=f.read()
+            )
+        tags.setall("APIC:Cover", [cover])
+        changed = True
+
+    if changed:
+        tags.save(file, v2_version=3)
+    return changed
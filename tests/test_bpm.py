@@ -0,0 +1,61 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import bpm
+
+
+def fake_detection(audio_path, timeout, fast):
+    """Takes the worker process down for crash.mp3, slowly returns 120 else."""
+    if audio_path == "crash.mp3":
+        time.sleep(0.1)
+        os._exit(1)
+    time.sleep(0.5)
+    return 120
+
+
+@pytest.fixture(autouse=True)
+def fake_bpm(monkeypatch):
+    monkeypatch.setattr(bpm, "_get_bpm_with_timeout", fake_detection)
+
+
+PATHS = ["a.mp3", "b.mp3", "crash.mp3", "c.mp3"]
+
+
+def test_pool_only_fails_the_file_that_crashed():
+    pool = bpm.BpmPool(workers=4)
+
+    def detect(audio_path):
+        try:
+            return pool.get_bpm(audio_path)
+        except BrokenProcessPool:
+            return "crashed"
+
+    with ThreadPoolExecutor(max_workers=len(PATHS)) as threads:
+        results = dict(zip(PATHS, threads.map(detect, PATHS)))
+    assert pool.get_bpm("d.mp3") == 120
+    pool.close()
+
+    assert results == {
+        "a.mp3": 120,
+        "b.mp3": 120,
+        "crash.mp3": "crashed",
+        "c.mp3": 120,
+    }
+
+
+def test_batch_only_fails_the_file_that_crashed():
+    results = {
+        audio_path: (result, type(error))
+        for audio_path, result, error in bpm.get_bpm_batch(PATHS, workers=4)
+    }
+
+    assert results == {
+        "a.mp3": (120, type(None)),
+        "b.mp3": (120, type(None)),
+        "crash.mp3": (None, BrokenProcessPool),
+        "c.mp3": (120, type(None)),
+    }
@@ -0,0 +1,110 @@
+import io
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+from cover_art import CoverArtStore, is_valid_jpeg
+from track_records import SpotifyTrack
+
+
+def jpeg(seed) -> bytes:
+    """A JPEG of noise, so that most of the file is compressed image data."""
+    pixels = random.Random(seed).randbytes(128 * 128 * 3)
+    data = io.BytesIO()
+    Image.frombytes("RGB", (128, 128), pixels).save(data, format="JPEG")
+    return data.getvalue()
+
+
+class CoverServer(BaseHTTPRequestHandler):
+    images = {}
+    hits = 0
+
+    def do_GET(self):
+        type(self).hits += 1
+        body = self.images[self.path]
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    CoverServer.hits = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CoverServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def track(album_id, cover_url):
+    return SpotifyTrack(
+        id="track",
+        name="Song",
+        artist="Artist",
+        album_id=album_id,
+        album_name="Album",
+        cover_url=cover_url,
+        release_date="2020",
+        url="https://open.spotify.com/track/track",
+        isrc=None,
+        track_number=1,
+        disc_number=1,
+    )
+
+
+def test_cover_with_trailing_bytes_is_downloaded_once(server, tmp_path):
+    CoverServer.images = {"/padded": jpeg(1) + b"\x00" * 100}
+    store = CoverArtStore(tmp_path)
+
+    path = store.get(track("album", f"{server}/padded"))
+    assert path.read_bytes() == CoverServer.images["/padded"]
+    assert store.get(track("album", f"{server}/padded")) == path
+    store.close()
+
+    assert CoverServer.hits == 1
+
+
+def test_truncated_cover_is_rejected(server, tmp_path):
+    image = jpeg(2)
+    CoverServer.images = {"/truncated": image[: len(image) // 2]}
+    store = CoverArtStore(tmp_path)
+
+    with pytest.raises(ValueError):
+        store.get(track("album", f"{server}/truncated"))
+    store.close()
+
+    assert not store.path("album").exists()
+
+
+def test_truncated_cached_cover_is_downloaded_again(server, tmp_path):
+    image = jpeg(3)
+    CoverServer.images = {"/cover": image}
+    store = CoverArtStore(tmp_path)
+    store.path("album").write_bytes(image[: len(image) // 2])
+
+    path = store.get(track("album", f"{server}/cover"))
+    store.close()
+
+    assert path.read_bytes() == image
+    assert CoverServer.hits == 1
+
+
+def test_is_valid_jpeg(tmp_path):
+    image = jpeg(4)
+    path = tmp_path / "cover.jpg"
+    for data, valid in [
+        (image, True),
+        (image + b"\x00" * 100, True),
+        (image[: len(image) // 2], False),
+        (image[:-2], False),
+        (b"", False),
+    ]:
+        path.write_bytes(data)
+        assert is_valid_jpeg(path) == valid
@@ -0,0 +1,93 @@
+from create_playlists import sync_rule_playlists
+from playlist_sync import PlaylistSync
+from track_records import TrackRecord, TrackTable
+
+
+class FakeSpotify:
+    def __init__(self):
+        self.playlists = {}
+
+    def current_user_playlists(self, limit):
+        items = [
+            {
+                "id": playlist_id,
+                "name": playlist["name"],
+                "owner": {"id": "user"},
+                "snapshot_id": playlist["snapshot_id"],
+                "description": playlist["description"],
+            }
+            for playlist_id, playlist in self.playlists.items()
+        ]
+        return {"items": items, "next": None}
+
+    def user_playlist_create(self, user, name, public, description):
+        playlist_id = f"id{len(self.playlists)}"
+        self.playlists[playlist_id] = {
+            "name": name,
+            "description": description,
+            "tracks": [],
+            "snapshot_id": "0",
+        }
+        return {"id": playlist_id, "name": name, "snapshot_id": "0"}
+
+    def playlist_change_details(self, playlist_id, description):
+        self.playlists[playlist_id]["description"] = description
+
+    def _changed(self, playlist_id, tracks):
+        playlist = self.playlists[playlist_id]
+        playlist["tracks"] = tracks
+        playlist["snapshot_id"] = str(int(playlist["snapshot_id"]) + 1)
+        return {"snapshot_id": playlist["snapshot_id"]}
+
+    def playlist_add_items(self, playlist_id, items):
+        return self._changed(playlist_id, self.playlists[playlist_id]["tracks"] + items)
+
+    def playlist_remove_all_occurrences_of_items(self, playlist_id, items):
+        tracks = self.playlists[playlist_id]["tracks"]
+        return self._changed(
+            playlist_id, [track for track in tracks if track not in items]
+        )
+
+    def tracks(self, name):
+        return next(
+            playlist["tracks"]
+            for playlist in self.playlists.values()
+            if playlist["name"] == name
+        )
+
+
+def sync(spotify, tmp_path, records):
+    playlist_sync = PlaylistSync(spotify, "user", tmp_path / "state.json")
+    sync_rule_playlists(
+        playlist_sync, TrackTable(records), output_dir=tmp_path / "playlists"
+    )
+
+
+def test_playlists_without_tracks_are_emptied(tmp_path):
+    spotify = FakeSpotify()
+    rock = TrackRecord("music/Rock/a.mp3", spotify_id="a", bpm=120.0)
+    jazz = TrackRecord("music/Jazz/b.mp3", spotify_id="b")
+    sync(spotify, tmp_path, [rock, jazz])
+    assert spotify.tracks("Workout 120 BPM") == ["a"]
+    assert spotify.tracks("Jazz") == ["b"]
+
+    # The BPM of a was removed and the Jazz folder deleted
+    sync(spotify, tmp_path, [rock._replace(bpm=None)])
+
+    assert spotify.tracks("Workout 120 BPM") == []
+    assert spotify.tracks("Jazz") == []
+    assert spotify.tracks("Rock") == ["a"]
+    assert (tmp_path / "playlists" / "Jazz.m3u").read_text() == "#EXTM3U\n"
+    # Empty playlists that were never synced are not created
+    assert len(spotify.playlists) == 3
+
+
+def test_deleted_empty_playlist_is_not_created_again(tmp_path):
+    spotify = FakeSpotify()
+    sync(spotify, tmp_path, [TrackRecord("music/Jazz/b.mp3", spotify_id="b")])
+    spotify.playlists.clear()
+
+    sync(spotify, tmp_path, [])
+    sync(spotify, tmp_path, [])
+
+    assert spotify.playlists == {}
@@ -0,0 +1,79 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+import main
+from track_records import SpotifyTrack
+
+TRACK = SpotifyTrack(
+    id="track",
+    name="Song",
+    artist="Artist",
+    album_id="album",
+    album_name="Album",
+    cover_url=None,
+    release_date="2020",
+    url="https://open.spotify.com/track/track",
+    isrc=None,
+    track_number=1,
+    disc_number=1,
+)
+
+
+class FakeBpmPool:
+    def __init__(self, bpm=None):
+        self.bpm = bpm
+
+    def get_bpm(self, audio_path):
+        if self.bpm is None:
+            raise RuntimeError("BPM detection failed")
+        return self.bpm
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def organizer(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["main.py"])
+    # Only the bookkeeping of the stages is tested, not the tag writing
+    monkeypatch.setattr(main, "update_metadata", lambda *args: None)
+    Path("music").mkdir()
+    Path("music/Artist - Song.mp3").write_bytes(b"\0" * 1000)
+
+    organizer = main.Organizer(main.parse_args(), spotify=None)
+    organizer.bpm_pool.close()
+    yield organizer
+    organizer.close()
+
+
+def process(organizer, file):
+    for item in organizer.detect_bpm((file, TRACK, None)):
+        list(organizer.write_tags(item))
+
+
+def test_failed_bpm_is_retried(organizer):
+    file = Path("music/Artist - Song.mp3")
+
+    organizer.bpm_pool = FakeBpmPool()
+    process(organizer, file)
+    assert not organizer.index.is_processed(file)
+    assert main.needs_update(file, TRACK, organizer.index)
+
+    organizer.bpm_pool = FakeBpmPool(bpm=120)
+    process(organizer, file)
+    assert organizer.index.is_processed(file)
+    assert not main.needs_update(file, TRACK, organizer.index)
+
+
+def test_scan_stage_reads_the_tags_of_its_batch(organizer):
+    file = Path("music/Artist - Song.mp3")
+    Path("music/cover.jpg").write_bytes(b"")
+    assert organizer.records == {}
+
+    files = list(organizer.scan([file, Path("music/cover.jpg")]))
+
+    assert files == [file]
+    assert list(organizer.records) == [str(file)]
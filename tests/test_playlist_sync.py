@@ -0,0 +1,40 @@
+from playlist_sync import PlaylistSync
+
+
+class FakeSpotify:
+    def __init__(self, description):
+        self.playlist = {
+            "id": "playlist",
+            "name": "Rock & Roll",
+            "owner": {"id": "user"},
+            "snapshot_id": "snapshot",
+            "description": description,
+        }
+        self.changed = []
+
+    def current_user_playlists(self, limit):
+        return {"items": [self.playlist], "next": None}
+
+    def playlist_items(self, playlist_id, **kwargs):
+        return {"items": [{"track": {"id": "track"}}], "next": None}
+
+    def playlist_change_details(self, playlist_id, description):
+        self.changed.append(description)
+
+
+def test_escaped_description_is_not_changed(tmp_path):
+    spotify = FakeSpotify("Rock &amp; Roll &gt; 120 BPM")
+    sync = PlaylistSync(spotify, "user", tmp_path / "state.json")
+
+    sync.sync("Rock & Roll", ["track"], description="Rock & Roll > 120 BPM")
+
+    assert spotify.changed == []
+
+
+def test_changed_description_is_updated(tmp_path):
+    spotify = FakeSpotify(None)
+    sync = PlaylistSync(spotify, "user", tmp_path / "state.json")
+
+    sync.sync("Rock & Roll", ["track"], description="Songs")
+
+    assert spotify.changed == ["Songs"]
@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import recognize
+from recognition_cache import RecognitionCache
+from recognize import AuddClient
+
+MATCH = {"status": "success", "result": {"title": "Song", "artist": "Artist"}}
+
+
+async def recognize_with_stub(responses):
+    """
+    Send one segment to a stub of the AudD API that answers with the queued
+    (status, headers) pairs and then with a match. Returns the result, the
+    number of requests and the seconds it took.
+    """
+    requests = []
+
+    async def handler(request):
+        form = await request.post()
+        requests.append(form)
+        if responses:
+            status, headers = responses.pop(0)
+            return web.Response(status=status, headers=headers)
+        return web.json_response(MATCH)
+
+    app = web.Application()
+    app.router.add_post("/", handler)
+    async with TestServer(app) as server:
+        async with aiohttp.ClientSession() as session:
+            client = AuddClient(session, url=str(server.make_url("/")), api_token="t")
+            start = time.monotonic()
+            result = await client.recognize_song(b"segment")
+            elapsed = time.monotonic() - start
+
+    assert all(form["api_token"] == "t" for form in requests)
+    return result, len(requests), elapsed
+
+
+def test_retries_429_after_retry_after(monkeypatch):
+    monkeypatch.setattr(recognize, "RETRY_BACKOFF", 0.01)
+    result, requests, elapsed = asyncio.run(
+        recognize_with_stub([(429, {"Retry-After": "0.5"})])
+    )
+    assert result == MATCH
+    assert requests == 2
+    assert elapsed >= 0.5
+
+
+def test_retries_server_errors_with_backoff(monkeypatch):
+    monkeypatch.setattr(recognize, "RETRY_BACKOFF", 0.01)
+    result, requests, _ = asyncio.run(recognize_with_stub([(503, {}), (503, {})]))
+    assert result == MATCH
+    assert requests == 3
+
+
+def test_gives_up_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(recognize, "RETRY_BACKOFF", 0.01)
+    responses = [(503, {})] * recognize.MAX_ATTEMPTS
+    result, requests, _ = asyncio.run(recognize_with_stub(responses))
+    assert result is None
+    assert requests == recognize.MAX_ATTEMPTS
+
+
+def test_does_not_retry_client_errors():
+    result, requests, _ = asyncio.run(recognize_with_stub([(400, {})]))
+    assert result is None
+    assert requests == 1
+
+
+def test_cache_stores_only_definite_answers(tmp_path):
+    cache = RecognitionCache(tmp_path / "cache.db")
+    cache.put("match", MATCH)
+    cache.put("no match", {"status": "success", "result": None})
+    cache.put("limit", {"status": "error", "error": {"error_code": 901}})
+    assert cache.get("match") == MATCH
+    assert cache.get("no match") == {"status": "success", "result": None}
+    assert cache.get("limit") is None
+    cache.close()
@@ -0,0 +1,57 @@
+import sqlite3
+
+import pytest
+
+from spotify_cache import ACCESS_FLUSH_INTERVAL, CachedSpotify, SpotifyCacheMiss
+
+
+class FakeSpotify:
+    def __init__(self):
+        self.requested = []
+
+    def tracks(self, tracks, market=None):
+        self.requested.append(list(tracks))
+        return {"tracks": [{"id": track_id} for track_id in tracks]}
+
+    def search(self, q, limit=10, offset=0, type="track", market=None):
+        return {"tracks": {"items": []}}
+
+
+def test_offline_tracks_returns_cached_and_none_for_misses(tmp_path):
+    spotify = FakeSpotify()
+    path = tmp_path / "cache.db"
+    online = CachedSpotify(spotify, path=path)
+    ids = [f"id{i}" for i in range(50)]
+    online.tracks(ids[:49], market="DE")
+    online.close()
+
+    offline = CachedSpotify(spotify, path=path, offline=True)
+    tracks = offline.tracks(ids, market="DE")["tracks"]
+    offline.close()
+
+    assert tracks[:49] == [{"id": track_id} for track_id in ids[:49]]
+    assert tracks[49] is None
+    assert spotify.requested == [ids[:49]]
+
+
+def test_offline_search_raises_on_miss(tmp_path):
+    offline = CachedSpotify(FakeSpotify(), path=tmp_path / "cache.db", offline=True)
+    with pytest.raises(SpotifyCacheMiss):
+        offline.search("query")
+    offline.close()
+
+
+def test_cache_hits_do_not_keep_a_write_transaction_open(tmp_path):
+    path = tmp_path / "cache.db"
+    cache = CachedSpotify(FakeSpotify(), path=path)
+    cache.tracks(["id0"], market="DE")
+
+    for _ in range(ACCESS_FLUSH_INTERVAL + 1):
+        cache.tracks(["id0"], market="DE")
+        # Other processes can still write to the cache
+        assert not cache.connection.in_transaction
+    flushed = sqlite3.connect(path).execute(
+        "SELECT accessed_at > created_at FROM responses"
+    )
+    assert flushed.fetchone() == (1,)
+    cache.close()
@@ -0,0 +1,85 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import spotipy
+from spotipy import SpotifyException
+
+import spotify_search
+from spotify_search import TokenBucket, search_track, spotify_session
+
+
+class MockSpotify(BaseHTTPRequestHandler):
+    """Responds with the queued statuses, then with an empty search result."""
+
+    statuses = []
+    hits = 0
+
+    def do_GET(self):
+        type(self).hits += 1
+        status = self.statuses.pop(0) if self.statuses else 200
+        body = json.dumps({"tracks": {"items": []}}).encode()
+        self.send_response(status)
+        if status == 429:
+            self.send_header("Retry-After", "0.2")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def spotify():
+    MockSpotify.statuses = []
+    MockSpotify.hits = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockSpotify)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    client = spotipy.Spotify(auth="token", requests_session=spotify_session())
+    client.prefix = f"http://127.0.0.1:{server.server_port}/v1/"
+    yield client
+    server.shutdown()
+
+
+class RecordingBucket(TokenBucket):
+    def __init__(self):
+        super().__init__(rate=1000)
+        self.pauses = []
+
+    def pause(self, seconds):
+        self.pauses.append(seconds)
+
+
+def test_429_is_only_retried_by_search_track(spotify, monkeypatch):
+    monkeypatch.setattr(spotify_search, "MAX_RETRIES", 1)
+    MockSpotify.statuses = [429] * 10
+    bucket = RecordingBucket()
+
+    with pytest.raises(SpotifyException) as error:
+        search_track(spotify, "query", bucket)
+
+    assert error.value.http_status == 429
+    assert MockSpotify.hits == 2
+    assert bucket.pauses == [0.2]
+
+
+def test_search_track_pauses_for_retry_after(spotify):
+    MockSpotify.statuses = [429]
+    bucket = RecordingBucket()
+
+    assert search_track(spotify, "query", bucket) == {"tracks": {"items": []}}
+    assert MockSpotify.hits == 2
+    assert bucket.pauses == [0.2]
+
+
+def test_server_errors_are_retried_by_the_session(spotify):
+    MockSpotify.statuses = [503]
+
+    assert search_track(spotify, "query", RecordingBucket()) == {
+        "tracks": {"items": []}
+    }
+    assert MockSpotify.hits == 2
@@ -0,0 +1,112 @@
+import os
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from parse_year import parse_year
+
+
+class TrackRecord(NamedTuple):
+    """
+    The tags of a file in the library, as stored in the library index.
+    """
+
+    path: str
+    size: Optional[int] = None
+    mtime_ns: Optional[int] = None
+    website: Optional[str] = None
+    spotify_id: Optional[str] = None
+    bpm: Optional[float] = None
+    year: Optional[int] = None
+    title: Optional[str] = None
+    artist: Optional[str] = None
+    duration: Optional[float] = None
+    has_cover: bool = False
+    cover_hash: Optional[str] = None
+    error: Optional[str] = None
+
+
+class SpotifyTrack(NamedTuple):
+    """
+    The fields of a Spotify API track object used by the scripts.
+    """
+
+    id: str
+    name: str
+    artist: str
+    album_id: str
+    album_name: str
+    cover_url: Optional[str]
+    release_date: str
+    url: str
+    isrc: Optional[str]
+    track_number: int
+    disc_number: int
+
+    @classmethod
+    def from_api(cls, track: dict):
+        images = track["album"]["images"]
+        return cls(
+            id=track["id"],
+            name=track["name"],
+            artist=track["artists"][0]["name"],
+            album_id=track["album"]["id"],
+            album_name=track["album"]["name"],
+            cover_url=images[0]["url"] if images else None,
+            release_date=track["album"]["release_date"],
+            url=track["external_urls"]["spotify"],
+            isrc=track["external_ids"].get("isrc") or None,
+            track_number=track["track_number"],
+            disc_number=track["disc_number"],
+        )
+
+    @property
+    def year(self) -> int:
+        return parse_year(self.release_date)
+
+
+class TrackTable:
+    """
+    Column-wise table of the matched files of the library.
+
+    Numeric columns are NumPy arrays, so whole-library grouping and sorting is
+    done with array operations. Missing BPMs and durations are NaN and missing
+    years 0.
+    """
+
+    def __init__(self, records: list):
+        records = [
+            record for record in records if record.spotify_id and not record.error
+        ]
+        self.paths = [record.path for record in records]
+        self.spotify_ids = [record.spotify_id for record in records]
+        self.folders = np.array(
+            [os.path.basename(os.path.dirname(path)) for path in self.paths],
+            dtype=object,
+        )
+        self.bpms = np.array(
+            [np.nan if record.bpm is None else record.bpm for record in records],
+            dtype=float,
+        )
+        self.years = np.array([record.year or 0 for record in records], dtype=int)
+        self.titles = [record.title for record in records]
+        self.artists = np.array([record.artist for record in records], dtype=object)
+        self.durations = np.array(
+            [
+                np.nan if record.duration is None else record.duration
+                for record in records
+            ],
+            dtype=float,
+        )
+
+    def __len__(self):
+        return len(self.paths)
+
+    def select(self, rows) -> tuple[list, list]:
+        """
+        Get the Spotify IDs and paths of the given rows.
+        """
+        return (
+            [self.spotify_ids[row] for row in rows],
+            [self.paths[row] for row in rows],
+        )